@@ -7,6 +7,8 @@ from .client.client import Client as Client
 from .utils.log import log as log
 from .utils.log import install_loguru as install_loguru
 from .utils.sign import sign_provider
+from .supervisor import Supervisor as Supervisor
+from .sharded import ShardedHost as ShardedHost
 from .info import InfoManager
 from .info.app import app_list
 from .utils.binary.protobuf.models import evaluate_all
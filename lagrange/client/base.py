@@ -70,6 +70,7 @@ class BaseClient:
             use_v6=use_ipv6,
         )
         self._sign_provider = sign_provider
+        self._last_write: Optional[asyncio.Future[None]] = None
 
         self._t106 = b""
         self._t16a = b""
@@ -89,12 +90,14 @@ class BaseClient:
         self._network.destroy_connection()
 
     def get_seq(self) -> int:
-        try:
-            return self._sig.sequence
-        finally:
+        """跳过仍在等待响应的 seq, 避免回绕到 0x8000 后覆盖旧请求"""
+        while True:
+            seq = self._sig.sequence
             if self._sig.sequence >= 0x8000:
                 self._sig.sequence = 0
             self._sig.sequence += 1
+            if seq not in self._network.pending:
+                return seq
 
     def connect(self) -> None:
         if "loop" not in self._tasks:
@@ -181,6 +184,10 @@ class BaseClient:
     def using_ipv6(self) -> bool:
         return self._network.using_v6
 
+    @property
+    def network(self) -> ClientNetwork:
+        return self._network
+
     @overload
     async def send_uni_packet(
         self, cmd: str, buf: bytes, *, timeout=10
@@ -198,22 +205,30 @@ class BaseClient:
 
     async def send_uni_packet(self, cmd, buf, send_only: bool = False, timeout=10):
         seq = self.get_seq()
-        sign = None
-        if self._sign_provider:
-            sign = await self._sign_provider(cmd, seq, buf)
-        packet = build_uni_packet(
-            uin=self.uin,
-            seq=seq,
-            cmd=cmd,
-            sign=sign or {},
-            app_info=self.app_info,
-            device_info=self.device_info,
-            sig_info=self._sig,
-            body=buf,
-        )
-        if send_only:
-            return await self._network.send(packet, wait_seq=-1, timeout=timeout)
-        return await self._network.send(packet, wait_seq=seq, timeout=timeout)
+        # 按 seq 顺序入队, 但签名与组包不需要等前一个包发出, 可以与之重叠
+        prev, written = self._last_write, asyncio.get_running_loop().create_future()
+        self._last_write = written
+        try:
+            sign = None
+            if self._sign_provider:
+                sign = await self._sign_provider(cmd, seq, buf)
+            packet = build_uni_packet(
+                uin=self.uin,
+                seq=seq,
+                cmd=cmd,
+                sign=sign or {},
+                app_info=self.app_info,
+                device_info=self.device_info,
+                sig_info=self._sig,
+                body=buf,
+            )
+            if prev and not prev.done():
+                await asyncio.shield(prev)
+            await self._network.write(packet)
+        finally:
+            written.set_result(None)
+        if not send_only:
+            return await self._network.wait_response(seq, timeout)
 
     async def fetch_qrcode(self) -> Union[int, tuple[bytes, str]]:
         tlv = QrCodeTlvBuilder()
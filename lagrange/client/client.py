@@ -59,7 +59,7 @@ from lagrange.pb.service.group import (
 from lagrange.pb.service.oidb import OidbRequest, OidbResponse
 from lagrange.pb.highway.comm import IndexNode
 from lagrange.utils.binary.protobuf import proto_decode, proto_encode
-from lagrange.utils.httpcat import HttpCat
+from lagrange.utils.httpcat import HttpCatPool
 from lagrange.utils.log import log
 from lagrange.utils.operator import timestamp
 
@@ -104,6 +104,10 @@ class Client(BaseClient):
     def push_deliver(self) -> PushDeliver:
         return self._push_deliver
 
+    @property
+    def highway(self) -> HighWaySession:
+        return self._highway
+
     async def register(self) -> bool:
         if await super().register():
             self._events.emit(ClientOnline(), self)
@@ -593,7 +597,7 @@ class Client(BaseClient):
             f"https://ssl.ptlogin2.qq.com/jump?ptlang=1033&clientuin={self.uin}"
             f"&clientkey={await self._get_client_key()}&u1={jump}"
         )
-        resp = await HttpCat.request("GET", url, follow_redirect=False)
+        resp = await HttpCatPool.default().request("GET", url, follow_redirect=False)
         return resp.cookies["skey"]
 
     async def get_csrf_token(self) -> int:
@@ -611,5 +615,5 @@ class Client(BaseClient):
             4: {1: [10, 20, 2]},
         }
         rsp = await self.send_oidb_svc(0x9067, 202, proto_encode(body), True)
-        temp = proto_decode(rsp.data).into((4, 1), dict[int, list[bytes]])
+        temp = proto_decode(rsp.data).into((4, 1), list[dict[int, bytes]])
         return temp[0][1].decode(), temp[1][1].decode()
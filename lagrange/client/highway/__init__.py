@@ -1,3 +1,5 @@
+from .cache import UploadCache
 from .highway import HighWaySession
+from .uploader import UploadProgressStore
 
-__all__ = ["HighWaySession"]
+__all__ = ["HighWaySession", "UploadCache", "UploadProgressStore"]
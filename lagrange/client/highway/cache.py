@@ -0,0 +1,180 @@
+"""
+Upload dedup cache
+"""
+
+import copy
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import asdict, replace
+from typing import Any, BinaryIO, Optional, Union
+
+from lagrange.client.message.elems import Audio, Image
+from lagrange.utils.log import log
+
+_logger = log.fork("highway")
+
+_KINDS: dict[str, type] = {"image": Image, "voice": Audio}
+_BYTES_FIELDS = ("md5", "qmsg")
+
+
+class UploadCache:
+    """
+    按 (md5, 类型, gid/uid) 缓存已上传的 Image/Audio, 同一内容再次发到同一目标时不再请求服务器.
+    默认只在内存中(LRU + TTL), 指定 path 时额外写入 sqlite, 重启后仍然有效;
+    普通文件还会按 (设备, inode, 大小, mtime) 记住 md5, 命中时连哈希也可以跳过.
+    带 rkey 的 url 会过期, 不会被缓存, 命中时 url 为空, 需要由调用方用一同保存的 IndexNode 重新获取
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[str, os.PathLike[str]]] = None,
+        *,
+        max_size: int = 1024,
+        ttl: float = 3600,
+        max_files: int = 4096,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_files = max_files
+        self._cache: OrderedDict[str, tuple[float, Any, bytes]] = OrderedDict()  # 创建时间, 元素, IndexNode
+        self._files: OrderedDict[tuple, bytes] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS upload_cache_v2"
+                " (key TEXT PRIMARY KEY, kind TEXT, created REAL, elem TEXT, node BLOB)"
+            )
+            self._db.execute("DROP TABLE IF EXISTS upload_cache")  # 旧版本保存的是 pickle, 不再读取
+            self._db.execute("DELETE FROM upload_cache_v2 WHERE created < ?", (time.time() - ttl,))
+
+        self.hits = 0
+        self.disk_hits = 0  # hits 中来自 sqlite 的部分
+        self.file_hits = 0  # 通过文件身份跳过哈希的次数
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(md5: bytes, kind: str, gid: int = 0, uid: str = "") -> str:
+        return f"{md5.hex()}:{kind}:{f'g{gid}' if gid else f'u{uid}'}"
+
+    @staticmethod
+    def _dump(elem: Any) -> str:
+        data = asdict(elem)
+        for name in _BYTES_FIELDS:
+            if data[name] is not None:
+                data[name] = data[name].hex()
+        return json.dumps(data)
+
+    @staticmethod
+    def _load(kind: str, raw: str) -> Any:
+        data = json.loads(raw)
+        for name in _BYTES_FIELDS:
+            if data[name] is not None:
+                data[name] = bytes.fromhex(data[name])
+        return _KINDS[kind](**data)
+
+    def get(self, md5: bytes, kind: str, gid: int = 0, uid: str = "") -> Optional[Any]:
+        """返回缓存元素的副本, 调用方可以随意修改"""
+        hit = self.lookup(md5, kind, gid, uid)
+        return hit[0] if hit else None
+
+    def lookup(self, md5: bytes, kind: str, gid: int = 0, uid: str = "") -> Optional[tuple[Any, bytes]]:
+        """返回缓存元素的副本以及上传时的 IndexNode(已编码, 可能为空), 用于重新获取下载地址"""
+        key = self.key(md5, kind, gid, uid)
+        now = time.time()
+        entry = self._cache.get(key)
+        if entry and now - entry[0] > self.ttl:
+            del self._cache[key]
+            entry = None
+        if not entry and self._db:
+            row = self._db.execute(
+                "SELECT kind, created, elem, node FROM upload_cache_v2 WHERE key = ? AND created >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row:
+                try:
+                    entry = (row[1], self._load(row[0], row[2]), row[3] or b"")
+                except Exception as e:
+                    _logger.warning(f"broken upload cache entry {key}: {e!r}")
+                    self._db.execute("DELETE FROM upload_cache_v2 WHERE key = ?", (key,))
+                else:
+                    self.disk_hits += 1
+                    self._store(key, entry)
+        if not entry:
+            self.misses += 1
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return copy.copy(entry[1]), entry[2]
+
+    def put(self, md5: bytes, kind: str, gid: int, uid: str, elem: Any, node: bytes = b""):
+        key = self.key(md5, kind, gid, uid)
+        if "rkey=" in elem.url:
+            elem = replace(elem, url="")
+        entry = (time.time(), copy.copy(elem), node)
+        self._store(key, entry)
+        if self._db and kind in _KINDS:
+            self._db.execute(
+                "INSERT OR REPLACE INTO upload_cache_v2 VALUES (?, ?, ?, ?, ?)",
+                (key, kind, entry[0], self._dump(entry[1]), node),
+            )
+
+    def _store(self, key: str, entry: tuple[float, Any, bytes]):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _identity(f: BinaryIO) -> Optional[tuple]:
+        try:
+            st = os.fstat(f.fileno())
+        except (AttributeError, OSError, ValueError):
+            return None
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def file_md5(self, f: BinaryIO) -> Optional[bytes]:
+        """同一文件(未修改)之前计算过的 md5"""
+        ident = self._identity(f)
+        md5 = self._files.get(ident) if ident else None
+        if md5:
+            self._files.move_to_end(ident)
+            self.file_hits += 1
+        return md5
+
+    def remember_file(self, f: BinaryIO, md5: bytes):
+        ident = self._identity(f)
+        if ident:
+            self._files[ident] = md5
+            while len(self._files) > self.max_files:
+                self._files.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
+        self._files.clear()
+        if self._db:
+            self._db.execute("DELETE FROM upload_cache_v2")
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "file_hits": self.file_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
@@ -1,8 +1,10 @@
 import asyncio
+import os
 import time
-from hashlib import md5
+from collections.abc import Awaitable
+from concurrent.futures import Executor
 from io import BytesIO
-from typing import TYPE_CHECKING, BinaryIO, Optional, Union
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Optional, TypeVar, Union
 
 from lagrange.client.message.elems import Audio, Image
 from lagrange.pb.highway.comm import IndexNode
@@ -11,25 +13,33 @@ from lagrange.pb.highway.httpconn import HttpConn0x6ffReq, HttpConn0x6ffRsp
 from lagrange.pb.highway.rsp import NTV2RichMediaResp, DownloadRsp
 from lagrange.utils.binary.protobuf import proto_decode
 from lagrange.utils.crypto.tea import qqtea_encrypt
-from lagrange.utils.httpcat import HttpCat
+from lagrange.utils.httpcat import HttpCatPool
 from lagrange.utils.image import decoder as decoder_img
 from lagrange.utils.audio import decoder as decoder_audio
 from lagrange.utils.log import log
 
+from .cache import UploadCache
 from .encoders import (
     encode_audio_upload_req,
-    encode_highway_head,
     encode_upload_img_req,
     encode_audio_down_req,
     encode_grp_img_download_req,
     encode_pri_img_download_req,
 )
-from .frame import read_frame, write_frame
-from .utils import calc_file_hash_and_length, timeit
+from .uploader import (
+    BlockUploadError,
+    HighwayUploader,
+    UploadAbortedError,
+    UploadProgressStore,
+    UploadStats,
+    default_io_executor,
+)
+from .utils import PreparedMedia, calc_file_hash_and_length, file_size, prepare_media
 
 if TYPE_CHECKING:
     from lagrange.client.client import Client
 
+T = TypeVar("T")
 
 class HighWaySession:
     def __init__(self, client: "Client"):
@@ -38,6 +48,24 @@ class HighWaySession:
         self._session_sig: Optional[bytes] = None
         self._session_key: Optional[bytes] = None
         self._session_addr_list: list[tuple[str, int]] = []
+        # 可由多个账号共享, 限制同时进行的上传数量
+        self.upload_limit: Optional[asyncio.Semaphore] = None
+        # 单个文件的并发连接数, 每个连接同时在途的块数
+        self.upload_connections = 4
+        self.upload_pipeline = 1
+        # upload_image / upload_voice 使用的块大小; upload_controller 的默认块大小仍为 bs=65535
+        self.media_block_size = 1048576
+        self.last_upload_stats: Optional[UploadStats] = None
+        # 未完成上传的进度, 传入带 path 的 UploadProgressStore 可在重启后续传
+        self.upload_progress = UploadProgressStore()
+        # 所有地址都失败后重新获取 highway session 并从已确认的块继续的次数
+        self.upload_resume_attempts = 1
+        # 读文件与哈希放到线程池中执行, 为 None 时使用共享的 default_io_executor();
+        # 小于 inline_hash_size 的文件或块直接在事件循环中计算
+        self.io_executor: Optional[Executor] = None
+        self.inline_hash_size = 65536
+        # 已上传的图片与语音, 设为 None 关闭; UploadCache(path) 可在重启后保留
+        self.upload_cache: Optional[UploadCache] = UploadCache()
 
     async def _get_bdh_session(self):
         rsp = await self._client.send_uni_packet(
@@ -49,12 +77,14 @@ class HighWaySession:
             raise ValueError("info not found, try again later")
         self._session_sig = pb.body.sig_session
         self._session_key = pb.body.sig_key
+        addrs = []
         for iplist in pb.body.servers:
             if self._client.using_ipv6:
                 for v6 in iplist.v6_addr:
-                    self._session_addr_list.append((v6.ip, v6.port))
+                    addrs.append((v6.ip, v6.port))
             for v4 in iplist.v4_addr:
-                self._session_addr_list.append((v4.ip, v4.port))
+                addrs.append((v4.ip, v4.port))
+        self._session_addr_list = addrs
 
     @classmethod
     def _down_url(cls, info: DownloadRsp) -> str:
@@ -70,6 +100,16 @@ class HighWaySession:
             raise KeyError("session key not set, try again later?")
         return qqtea_encrypt(ext, self._session_key)
 
+    async def _run_io(self, size: int, func: Callable[..., T], *args) -> T:
+        if size < self.inline_hash_size:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.io_executor or default_io_executor(), func, *args
+        )
+
+    async def prepare_media(self, file: BinaryIO, decoder: Optional[Callable[[BinaryIO], Any]] = None) -> PreparedMedia:
+        return await self._run_io(file_size(file), prepare_media, file, self.media_block_size, decoder)
+
     async def upload_controller(
         self,
         *files: BinaryIO,
@@ -77,107 +117,114 @@ class HighWaySession:
         ticket: bytes,
         ext=None,
         addrs: Optional[list[tuple[str, int]]] = None,
-        bs=65535,
+        bs: int = 65535,
+        prepared: Optional[PreparedMedia] = None,
     ) -> Optional[bytes]:
-        if not addrs:
-            addrs = self._session_addr_list
-        for addr in addrs:
-            try:
-                sec, data = await timeit(
-                    self._bdh_uploader(
-                        "PicUp.DataUp",
-                        addr,
-                        list(files),
-                        cmd_id,
-                        ticket,
-                        ext,
-                        block_size=bs,
-                    )
-                )
-                self.logger.info("upload complete, use %.2fms" % (sec * 1000))
-                return data
-            except asyncio.TimeoutError:
-                self.logger.error(f"server {addr[0]}:{addr[1]} timeout")
-                continue
-            finally:
-                for f in files:
-                    f.seek(0)
+        """
+        prepared 为 prepare_media 的结果, 只上传单个文件时可以传入以免再次计算 md5, 此时使用其 block_size 而不是 bs
+        """
+        fixed_addrs = bool(addrs)
+        if prepared and len(files) == 1:
+            file_md5, block_md5s, bs = prepared.md5, prepared.block_md5s, prepared.block_size
+            hash_time = prepared.hash_time
         else:
-            raise ConnectionError("cannot upload, all server failure")
-
-    async def _bdh_uploader(
-        self,
-        cmd: str,
-        addr: tuple[str, int],
-        files: list[BinaryIO],
-        cmd_id: int,
-        ticket: bytes,
-        ext: Optional[bytes] = None,
-        *,
-        block_size=65535,
-    ) -> Optional[bytes]:
-        fmd5, _, fl = calc_file_hash_and_length(*files)
-        ts = int(time.time() * 1000)
-        bc = 0
-        total_transfer = 0
-        current_file = files.pop(0)
-        async with HttpCat(
-            *addr,
-            headers={
-                "Accept-Encoding": "identity",
-                "User-Agent": "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2)",
-            },
-        ) as session:
+            start = time.perf_counter()
+            file_md5 = (await self._run_io(file_size(*files), calc_file_hash_and_length, *files))[0]
+            block_md5s, hash_time = None, time.perf_counter() - start
+        if self.upload_limit:
+            await self.upload_limit.acquire()
+        try:
+            attempt = 0
             while True:
-                bl = current_file.read(block_size)
-                if not bl and not files:
-                    return ext
-                elif not bl:
-                    current_file = files.pop(0)
-                    continue
-
-                head = encode_highway_head(
-                    uin=self._client.uin,
-                    seq=0,
-                    cmd=cmd,
-                    cmd_id=cmd_id,
-                    file_size=fl,
-                    file_offset=total_transfer,
-                    file_md5=fmd5,
-                    blk_size=len(bl),
-                    blk_md5=md5(bl).digest(),
-                    ticket=ticket,
-                    tgt=self._client._sig.tgt,
-                    app_id=self._client.app_info.app_id,
-                    sub_app_id=self._client.app_info.sub_app_id,
-                    timestamp=ts,
-                    ext_info=ext or b"",
-                ).encode()
-
-                rsp_http = await session.send_request(
-                    "POST",
-                    f"/cgi-bin/httpconn?htcmd=0x6FF0087&uin={self._client.uin}",
-                    write_frame(head, bl),
+                uploader = HighwayUploader(
+                    self,
+                    "PicUp.DataUp",
+                    cmd_id,
+                    ticket,
+                    ext,
+                    list(files),
+                    block_size=bs,
+                    connections=self.upload_connections,
+                    pipeline=self.upload_pipeline,
+                    file_md5=file_md5,
+                    block_md5s=block_md5s,
+                    store=self.upload_progress,
                 )
-                total_transfer += len(bl)
-
-                resp, data = read_frame(BytesIO(rsp_http.decompressed_body))
-                if resp.err_code:
-                    raise ConnectionError(resp.err_code, "upload error", resp)
-                elif resp and ext:
-                    if resp.ext_info:
-                        ext = resp.ext_info
-                    if resp.seg_head:
-                        if resp.seg_head.ticket:
-                            self._session_key = resp.seg_head.ticket
-
-                bc += 1
+                uploader.stats.hash_time = hash_time
+                try:
+                    data = await uploader.upload(addrs if fixed_addrs else self._session_addr_list)  # type: ignore
+                    self.logger.info(f"upload complete, {uploader.stats}")
+                    return data
+                except BlockUploadError as e:
+                    if isinstance(e, UploadAbortedError) or attempt >= self.upload_resume_attempts:
+                        raise
+                    attempt += 1
+                    self.logger.warning(
+                        f"upload interrupted at {uploader.progress.done}/{uploader.size} bytes ({e}), reconnecting"
+                    )
+                    old_sig = self._session_sig
+                    await self._get_bdh_session()
+                    if ticket == old_sig:
+                        ticket = self._session_sig  # type: ignore
+                finally:
+                    self.last_upload_stats = uploader.stats
+                    for f in files:
+                        f.seek(0)
+        finally:
+            if self.upload_limit:
+                self.upload_limit.release()
+
+    async def _upload_cached(
+        self,
+        kind: str,
+        upload: Callable[[BinaryIO, int, str, PreparedMedia], Awaitable[tuple[T, IndexNode]]],
+        decoder: Callable[[BinaryIO], Any],
+        file: BinaryIO,
+        gid: int,
+        uid: str,
+    ) -> T:
+        """相同内容发到同一目标时直接返回 upload_cache 中的元素, 不请求服务器"""
+        cache = self.upload_cache
+        known = cache.file_md5(file) if cache else None
+        if known:
+            hit = cache.lookup(known, kind, gid, uid)  # type: ignore
+            if hit:
+                return await self._refresh_url(*hit, gid, uid)
+        prepared = await self.prepare_media(file, decoder)
+        if cache:
+            cache.remember_file(file, prepared.md5)
+            if prepared.md5 != known:
+                hit = cache.lookup(prepared.md5, kind, gid, uid)
+                if hit:
+                    return await self._refresh_url(*hit, gid, uid)
+        elem, node = await upload(file, gid, uid, prepared)
+        if cache:
+            cache.put(prepared.md5, kind, gid, uid, elem, node.encode())
+        return elem
+
+    async def _refresh_url(self, elem: T, node: bytes, gid: int, uid: str) -> T:
+        """缓存不保存带 rkey 的 url, 命中时重新获取下载地址"""
+        if elem.url:  # type: ignore
+            return elem
+        if isinstance(elem, Audio):
+            elem.url = await self.get_audio_down_url(elem.file_key, gid, uid)
+        elif isinstance(elem, Image) and node:
+            index = IndexNode.decode(node)
+            if gid:
+                elem.url = await self.get_grp_img_url(gid, index)
+            else:
+                elem.url = await self.get_pri_img_url(uid, index)
+        return elem
 
     async def upload_image(self, file: BinaryIO, gid=0, uid="") -> Image:
+        return await self._upload_cached("image", self._upload_image, decoder_img.decode, file, gid, uid)
+
+    async def _upload_image(
+        self, file: BinaryIO, gid: int, uid: str, prepared: PreparedMedia
+    ) -> tuple[Image, IndexNode]:
         if not self._session_addr_list:
             await self._get_bdh_session()
-        fmd5, fsha1, fl = calc_file_hash_and_length(file)
-        info = decoder_img.decode(file)
+        fmd5, fsha1, fl, info = prepared.md5, prepared.sha1, prepared.size, prepared.info
         ret = NTV2RichMediaResp.decode(
             (
                 await self._client.send_oidb_svc(
@@ -202,7 +249,7 @@ class HighWaySession:
                 ret.upload.ukey,
                 ret.upload.v4_addrs,
                 ret.upload.msg_info.body,
-                1048576,
+                prepared.block_size,
                 fsha1,
             ).encode()
             if not self._session_sig:
@@ -212,8 +259,7 @@ class HighWaySession:
                 cmd_id=1004 if gid else 1003,
                 ticket=self._session_sig,
                 ext=ext,
-                addrs=self._session_addr_list,
-                bs=1048576,
+                prepared=prepared,
             )
         w, h = info.width, info.height
         if gid:
@@ -235,7 +281,7 @@ class HighWaySession:
             url=url,
             is_emoji=info.pic_type.name == "gif",
             qmsg=None if gid else ret.upload.compat_qmsg,
-        )
+        ), ret.upload.msg_info.body[0].index
 
     async def get_grp_img_url(self, grp_id: int, node: "IndexNode") -> str:
         ret = NTV2RichMediaResp.decode(
@@ -272,10 +318,14 @@ class HighWaySession:
         return f"https://{body.info.domain}{body.info.url_path}{body.rkey}"
 
     async def upload_voice(self, file: BinaryIO, gid=0, uid="") -> Audio:
+        return await self._upload_cached("voice", self._upload_voice, decoder_audio.decode, file, gid, uid)
+
+    async def _upload_voice(
+        self, file: BinaryIO, gid: int, uid: str, prepared: PreparedMedia
+    ) -> tuple[Audio, IndexNode]:
         if not self._session_addr_list:
             await self._get_bdh_session()
-        fmd5, fsha1, fl = calc_file_hash_and_length(file)
-        info = decoder_audio.decode(file)
+        fmd5, fsha1, fl, info = prepared.md5, prepared.sha1, prepared.size, prepared.info
         self.logger.debug(f"audio info: {info.type.name}-{info.time:.2f}s")
 
         ret = NTV2RichMediaResp.decode(
@@ -304,7 +354,7 @@ class HighWaySession:
                 ret.upload.ukey,
                 ret.upload.v4_addrs,
                 ret.upload.msg_info.body,
-                1048576,
+                prepared.block_size,
                 fsha1,
             ).encode()
             if not self._session_sig:
@@ -314,12 +364,11 @@ class HighWaySession:
                 cmd_id=1008 if gid else 1007,
                 ticket=self._session_sig,
                 ext=ext,
-                addrs=self._session_addr_list,
-                bs=1048576,
+                prepared=prepared,
             )
 
-        compat = proto_decode(ret.upload.compat_qmsg, 0).into(4, bytes)
-        pt = proto_decode(compat, 0)
+        compat = proto_decode(ret.upload.compat_qmsg).into(4, bytes)
+        pt = proto_decode(compat)
         if gid:
             file_id = pt.into(8, int)
             file_key = pt.into(18, bytes)
@@ -337,7 +386,7 @@ class HighWaySession:
             file_key=file_key.decode(),
             qmsg=None if gid else compat,
             url=await self.get_audio_down_url(file_key.decode(), gid, uid),
-        )
+        ), ret.upload.msg_info.body[0].index
 
     async def get_audio_down_url(self, file_key_or_audio: Union[str, Audio], gid: int = 0, uid: str = "") -> str:
         if not self._session_addr_list:
@@ -363,14 +412,27 @@ class HighWaySession:
         return self._down_url(ret.download)
 
     async def download_audio(self, audio: Audio, gid=0, uid="") -> BytesIO:
+        buf = BytesIO()
+        await self.download_audio_to(audio, buf, gid, uid)
+        buf.seek(0)
+        return buf
+
+    async def download_audio_to(
+        self,
+        audio: Audio,
+        target: Union[str, os.PathLike[str], BinaryIO],
+        gid=0,
+        uid="",
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+    ) -> int:
+        """以流的方式写入文件路径或文件对象, 内存占用与文件大小无关, 返回写入的字节数"""
         url = await self.get_audio_down_url(audio, gid, uid)
 
         # SSLV3_ALERT_HANDSHAKE_FAILURE on ssl env
-        http = await HttpCat.request("GET", url.replace("https", "http"))
-        if http.code != 200:
-            raise ConnectionError(http.code, http.status)
-
-        return BytesIO(http.decompressed_body)
+        async with await HttpCatPool.default().stream("GET", url.replace("https", "http")) as http:
+            if http.code != 200:
+                raise ConnectionError(http.code, http.status)
+            return await http.download_to(target, progress)
 
 
     # async def upload_video(self, file: BinaryIO, thumb: BinaryIO, gid: int) -> VideoElement:
@@ -0,0 +1,401 @@
+"""
+Concurrent highway uploader
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from hashlib import md5
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Optional, Union
+
+from lagrange.info.serialize import JsonSerializer
+from lagrange.utils.httpcat import HttpCat
+from lagrange.utils.log import log
+
+from .encoders import encode_highway_head
+from .frame import read_frame, write_frame
+
+if TYPE_CHECKING:
+    from .highway import HighWaySession
+
+_RETRY_ERRORS = (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError)
+
+IO_WORKERS = 4
+_io_executor: Optional[Executor] = None
+
+
+def default_io_executor() -> Executor:
+    """进程内共享的 highway 读文件与哈希线程池, 大小为 IO_WORKERS"""
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(IO_WORKERS, thread_name_prefix="lagrange-highway")
+    return _io_executor
+
+
+@dataclass
+class Block:
+    offset: int  # 在整个上传内容中的偏移
+    size: int
+    file: BinaryIO
+    file_offset: int  # 在所属文件中的偏移
+    md5: Optional[bytes] = None  # 预先计算的块 md5
+    retries: int = 0
+
+
+@dataclass
+class UploadStats:
+    size: int = 0
+    blocks: int = 0
+    sent: int = 0  # 实际发送的字节数, 包括重试
+    retries: int = 0
+    connections: int = 0
+    resumed: int = 0  # 从上次进度恢复, 无需再发送的字节数
+    hash_time: float = 0.0  # 读文件与计算哈希的耗时, 包括上传前的 prepare_media
+    elapsed: float = 0.0
+    per_connection: dict[int, int] = field(default_factory=dict)  # worker -> 已确认的字节数
+
+    @property
+    def throughput(self) -> float:
+        """本次实际上传的字节每秒"""
+        return (self.size - self.resumed) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.size / 1048576:.2f}MiB in {self.elapsed * 1000:.0f}ms "
+            f"({self.throughput / 1048576:.2f}MiB/s, {self.blocks} blocks, "
+            f"{self.connections} connections, {self.retries} retries, hash {self.hash_time * 1000:.0f}ms"
+            + (f", {self.resumed / 1048576:.2f}MiB resumed)" if self.resumed else ")")
+        )
+
+
+class BlockUploadError(ConnectionError):
+    pass
+
+
+class UploadAbortedError(BlockUploadError):
+    """服务器拒绝或本地文件出错, 重连后续传也不会成功"""
+
+
+@dataclass
+class UploadProgress(JsonSerializer):
+    """单个文件的上传进度, 块大小相同时才能续传"""
+
+    key: str
+    size: int
+    block_size: int
+    acked: dict[int, int] = field(default_factory=dict)  # 已确认的块: 偏移 -> 长度
+    ext: Optional[bytes] = None  # 服务器最近一次返回的 ext_info(包含 ukey)
+    ext_seed: bytes = b""  # 调用方传入的原始 ext 的 md5, 用于判断 ext 是否仍然可用
+    session_key: bytes = b""  # 服务器通过 seg_head.ticket 轮换后的 session key
+    updated: float = 0.0
+
+    @staticmethod
+    def make_key(file_md5: bytes, size: int, cmd_id: int, block_size: int) -> str:
+        return f"{file_md5.hex()}-{size}-{cmd_id}-{block_size}"
+
+    @property
+    def done(self) -> int:
+        """已确认的字节数"""
+        return sum(self.acked.values())
+
+    @classmethod
+    def load(cls, buffer: bytes) -> "UploadProgress":
+        data = json.loads(buffer)
+        return cls(
+            key=data["key"],
+            size=data["size"],
+            block_size=data["block_size"],
+            acked={int(k): v for k, v in data["acked"].items()},
+            ext=bytes.fromhex(data["ext"]) if data["ext"] is not None else None,
+            ext_seed=bytes.fromhex(data["ext_seed"]),
+            session_key=bytes.fromhex(data["session_key"]),
+            updated=data["updated"],
+        )
+
+    def dump(self) -> bytes:
+        # json 没有长度限制, 大文件的 acked 表或较长的 ext 也能完整保存
+        data = asdict(self)
+        data["ext"] = self.ext.hex() if self.ext is not None else None
+        data["ext_seed"] = self.ext_seed.hex()
+        data["session_key"] = self.session_key.hex()
+        return json.dumps(data).encode()
+
+
+class UploadProgressStore:
+    """
+    保存未完成上传的进度, 默认只在内存中;
+    指定 path 时每个文件的进度会写入 path 下的单独文件, 进程重启后仍可续传
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[str, os.PathLike[str]]] = None,
+        *,
+        max_entries: int = 64,
+        ttl: float = 86400,
+    ):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self.ttl = ttl  # 服务器端的 ukey 会过期, 太旧的进度没有意义
+        self._entries: OrderedDict[str, UploadProgress] = OrderedDict()
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, key: str) -> Path:
+        return self.path / f"{key}.json"  # type: ignore
+
+    def get(self, key: str) -> Optional[UploadProgress]:
+        progress = self._entries.get(key)
+        if not progress and self.path and self._file(key).is_file():
+            try:
+                progress = UploadProgress.load(self._file(key).read_bytes())
+            except Exception as e:
+                log.fork("highway").warning(f"broken upload progress {key}: {e!r}")
+                self._file(key).unlink(missing_ok=True)
+                return None
+        if not progress:
+            return None
+        if time.time() - progress.updated > self.ttl:
+            self.drop(key)
+            return None
+        self._entries[key] = progress
+        self._entries.move_to_end(key)
+        return progress
+
+    def save(self, progress: UploadProgress):
+        progress.updated = time.time()
+        self._entries[progress.key] = progress
+        self._entries.move_to_end(progress.key)
+        while len(self._entries) > self.max_entries:
+            self.drop(next(iter(self._entries)))
+        if self.path:
+            tmp = self._file(progress.key).with_suffix(".tmp")
+            tmp.write_bytes(progress.dump())
+            os.replace(tmp, self._file(progress.key))
+
+    def drop(self, key: str):
+        self._entries.pop(key, None)
+        if self.path:
+            self._file(key).unlink(missing_ok=True)
+
+
+def split_blocks(
+    files: list[BinaryIO], block_size: int, block_md5s: Optional[list[bytes]] = None
+) -> tuple[list[Block], int]:
+    """按 block_size 切分, 块不会跨越文件; block_md5s 与切分结果数量不一致时忽略"""
+    blocks = []
+    offset = 0
+    for f in files:
+        f.seek(0, 2)
+        length = f.tell()
+        f.seek(0)
+        for pos in range(0, length, block_size):
+            size = min(block_size, length - pos)
+            blocks.append(Block(offset, size, f, pos))
+            offset += size
+    if block_md5s and len(block_md5s) == len(blocks):
+        for blk, blk_md5 in zip(blocks, block_md5s):
+            blk.md5 = blk_md5
+    return blocks, offset
+
+
+class HighwayUploader:
+    """
+    把文件分块后通过多个 keep-alive 连接并发上传.
+    第 i 个连接从 addrs[i % len(addrs)] 开始, 出错时换下一个地址重连, 出错的块按 file_offset 重新排队;
+    pipeline > 1 时每个连接会连续发出多个请求再按顺序读取响应(HTTP/1.1 pipelining).
+    指定 store 时每个确认的块都会记录到 UploadProgress, 再次上传同一文件时跳过已确认的块.
+    读文件与计算块 md5 在 session.io_executor 中执行, 不阻塞事件循环
+    """
+
+    PATH = "/cgi-bin/httpconn?htcmd=0x6FF0087&uin={uin}"
+    HEADERS = {
+        "Accept-Encoding": "identity",
+        "User-Agent": "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2)",
+        "Connection": "keep-alive",
+    }
+
+    def __init__(
+        self,
+        session: "HighWaySession",
+        cmd: str,
+        cmd_id: int,
+        ticket: bytes,
+        ext: Optional[bytes],
+        files: list[BinaryIO],
+        *,
+        block_size: int = 65535,
+        connections: int = 4,
+        pipeline: int = 1,
+        max_retries: int = 3,
+        timeout: float = 30.0,
+        file_md5: bytes,
+        block_md5s: Optional[list[bytes]] = None,
+        store: Optional[UploadProgressStore] = None,
+    ):
+        self._session = session
+        self.cmd = cmd
+        self.cmd_id = cmd_id
+        self.ticket = ticket
+        self.ext = ext
+        self.block_size = block_size
+        self.connections = max(1, connections)
+        self.pipeline = max(1, pipeline)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.file_md5 = file_md5
+        blocks, self.size = split_blocks(files, block_size, block_md5s)
+        self.stats = UploadStats(size=self.size, blocks=len(blocks))
+        self._timestamp = int(time.time() * 1000)
+        self._file_locks = {id(f): threading.Lock() for f in files}  # 多个连接共用同一个文件对象
+
+        self._store = store
+        key = UploadProgress.make_key(self.file_md5, self.size, cmd_id, block_size)
+        ext_seed = md5(ext or b"").digest()
+        progress = store.get(key) if store else None
+        if progress and progress.acked and progress.ext_seed == ext_seed:
+            if progress.ext:
+                self.ext = progress.ext
+            if progress.session_key:
+                session._session_key = progress.session_key
+            blocks = [blk for blk in blocks if blk.offset not in progress.acked]
+            self.stats.resumed = progress.done
+        else:
+            # 调用方换了 ukey(ext), 旧会话中确认的块对新会话无效, 从头开始
+            if progress and store:
+                store.drop(key)
+            progress = UploadProgress(key, self.size, block_size, ext=ext, ext_seed=ext_seed)
+        self.progress = progress
+        self._queue: deque[Block] = deque(blocks)
+
+    def _read_block(self, blk: Block) -> tuple[bytes, bytes, float]:
+        start = time.perf_counter()
+        with self._file_locks[id(blk.file)]:
+            blk.file.seek(blk.file_offset)
+            data = blk.file.read(blk.size)
+        if len(data) != blk.size:
+            raise UploadAbortedError(f"file changed during upload: expect {blk.size} bytes, got {len(data)}")
+        return data, blk.md5 or md5(data).digest(), time.perf_counter() - start
+
+    async def _encode_block(self, blk: Block) -> bytes:
+        session = self._session
+        if blk.size < session.inline_hash_size:
+            data, blk_md5, cost = self._read_block(blk)
+        else:
+            data, blk_md5, cost = await asyncio.get_running_loop().run_in_executor(
+                session.io_executor or default_io_executor(), self._read_block, blk
+            )
+        self.stats.hash_time += cost
+        client = session._client
+        head = encode_highway_head(
+            uin=client.uin,
+            seq=0,
+            cmd=self.cmd,
+            cmd_id=self.cmd_id,
+            file_size=self.size,
+            file_offset=blk.offset,
+            file_md5=self.file_md5,
+            blk_size=blk.size,
+            blk_md5=blk_md5,
+            ticket=self.ticket,
+            tgt=client._sig.tgt,
+            app_id=client.app_info.app_id,
+            sub_app_id=client.app_info.sub_app_id,
+            timestamp=self._timestamp,
+            ext_info=self.ext or b"",
+        ).encode()
+        return write_frame(head, data)
+
+    def _on_response(self, worker: int, blk: Block, code: int, body: bytes):
+        if code != 200:
+            raise ConnectionError(code, "highway http error")
+        resp, _ = read_frame(BytesIO(body))
+        if resp.err_code:
+            if not resp.allow_retry:
+                raise UploadAbortedError(resp.err_code, "upload error", resp)
+            raise ConnectionError(resp.err_code, "upload error", resp)
+        if self.ext:
+            if resp.ext_info:
+                self.ext = resp.ext_info
+            if resp.seg_head and resp.seg_head.ticket:
+                self._session._session_key = resp.seg_head.ticket
+        self.progress.acked[blk.offset] = blk.size
+        self.progress.ext = self.ext
+        self.progress.session_key = self._session._session_key or b""
+        if self._store:
+            self._store.save(self.progress)
+        self.stats.per_connection[worker] = self.stats.per_connection.get(worker, 0) + blk.size
+
+    def _requeue(self, blocks: "deque[Block]", err: BaseException):
+        for blk in reversed(blocks):
+            blk.retries += 1
+            if blk.retries > self.max_retries:
+                raise BlockUploadError(f"block at {blk.offset} failed after {self.max_retries} retries") from err
+            self.stats.retries += 1
+            self._queue.appendleft(blk)
+        blocks.clear()
+
+    async def _worker(self, index: int, addrs: list[tuple[str, int]]):
+        uin = self._session._client.uin
+        addr_idx = index
+        inflight: deque[Block] = deque()
+        while self._queue:
+            host, port = addrs[addr_idx % len(addrs)]
+            writer = None
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+                self.stats.connections += 1
+                while self._queue or inflight:
+                    while self._queue and len(inflight) < self.pipeline:
+                        blk = self._queue.popleft()
+                        inflight.append(blk)
+                        body = await self._encode_block(blk)
+                        await HttpCat._write_request(
+                            host, writer, "POST", self.PATH.format(uin=uin), self.HEADERS, body
+                        )
+                        self.stats.sent += blk.size
+                    rsp = await asyncio.wait_for(HttpCat._parse_response(reader), self.timeout)
+                    self._on_response(index, inflight.popleft(), rsp.code, rsp.decompressed_body)
+                    if rsp.header.get("Connection", "").lower() == "close":
+                        break
+            except BlockUploadError:
+                raise
+            except _RETRY_ERRORS as e:
+                self._session.logger.warning(f"highway block upload to {host}:{port} failed: {e!r}")
+                self._requeue(inflight, e)
+                addr_idx += 1
+            finally:
+                if writer:
+                    writer.close()
+            self._requeue(inflight, ConnectionResetError("connection closed by server"))
+
+    async def upload(self, addrs: list[tuple[str, int]]) -> Optional[bytes]:
+        if not addrs:
+            raise ConnectionError("no highway server available")
+        start = time.monotonic()
+        workers = [
+            asyncio.create_task(self._worker(i, addrs), name=f"highway_upload_{i}")
+            for i in range(min(self.connections, len(self._queue)))
+        ]
+        try:
+            if workers:
+                done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if task.exception():
+                        raise task.exception()  # type: ignore
+                await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.stats.elapsed = time.monotonic() - start
+        if self._store:
+            self._store.drop(self.progress.key)
+        return self.ext
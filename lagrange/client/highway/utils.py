@@ -1,10 +1,93 @@
+import io
+import mmap
 import time
+from dataclasses import dataclass, field
 from hashlib import md5, sha1
-from typing import Any, BinaryIO
+from typing import Any, BinaryIO, Callable, Optional
 from collections.abc import Awaitable
 
 
-def calc_file_hash_and_length(*files: BinaryIO, bs=4096) -> tuple[bytes, bytes, int]:
+@dataclass
+class PreparedMedia:
+    """上传前一次读取得到的文件信息"""
+
+    md5: bytes
+    sha1: bytes
+    size: int
+    block_size: int
+    block_md5s: list[bytes] = field(default_factory=list)  # 按 block_size 切分后每块的 md5
+    info: Any = None  # decoder 的返回值, 如 ImageInfo, AudioInfo
+    hash_time: float = 0.0  # 读取与计算耗费的秒数
+
+
+def _map_file(f: BinaryIO) -> Optional[mmap.mmap]:
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):  # 非普通文件或空文件
+        return None
+
+
+def _read_full(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    while 0 < len(data) < size:
+        more = f.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def prepare_media(
+    f: BinaryIO, block_size: int = 1048576, decoder: Optional[Callable[[BinaryIO], Any]] = None
+) -> PreparedMedia:
+    """
+    一次读取同时计算 md5, sha1, 长度与每块的 md5, 并用 decoder 解析媒体信息.
+    普通文件使用 mmap, decoder 也直接读取映射, 不会再次读盘
+    """
+    start = time.perf_counter()
+    fm, fs, blocks, size = md5(), sha1(), [], 0
+    mm = _map_file(f)
+    try:
+        if mm is not None:
+            view = memoryview(mm)
+            try:
+                size = len(view)
+                for off in range(0, size, block_size):
+                    with view[off : off + block_size] as blk:
+                        fm.update(blk)
+                        fs.update(blk)
+                        blocks.append(md5(blk).digest())
+            finally:
+                view.release()
+            info = decoder(mm) if decoder else None  # type: ignore
+        else:
+            f.seek(0)
+            while True:
+                blk = _read_full(f, block_size)
+                if not blk:
+                    break
+                fm.update(blk)
+                fs.update(blk)
+                blocks.append(md5(blk).digest())
+                size += len(blk)
+            f.seek(0)
+            info = decoder(f) if decoder else None
+    finally:
+        if mm is not None:
+            mm.close()
+        f.seek(0)
+    return PreparedMedia(fm.digest(), fs.digest(), size, block_size, blocks, info, time.perf_counter() - start)
+
+
+def file_size(*files: BinaryIO) -> int:
+    size = 0
+    for f in files:
+        size += f.seek(0, 2)
+        f.seek(0)
+    return size
+
+
+def calc_file_hash_and_length(*files: BinaryIO, bs=1048576) -> tuple[bytes, bytes, int]:
     fm, fs, length = md5(), sha1(), 0
     for f in files:
         try:
@@ -11,7 +11,7 @@ from lagrange.pb.message.rich_text import Elems, RichText
 from . import elems
 from .types import Element
 from lagrange.utils.binary.reader import Reader
-from lagrange.utils.binary.protobuf import proto_encode
+from lagrange.utils.binary.protobuf import proto_decode, proto_encode
 from lagrange.pb.message.rich_text.elems import GroupFileExtra, FileExtra, PBKeyboard
 from lagrange.pb.highway.comm import MsgInfo
 
@@ -227,11 +227,8 @@ async def parse_msg_new(
             msg_text = ""
 
             for v in src.elems:
-                elem = v.get(1, {1: b""})[1]
-                if isinstance(elem, dict):
-                    msg_text += proto_encode(elem).decode()
-                else:
-                    msg_text += elem.decode()
+                if 1 in v:  # text elem
+                    msg_text += proto_decode(v[1]).into(1, bytes).decode()
             # src[10]: optional[grp_id]
             msg_chain.append(
                 elems.Quote(
@@ -5,15 +5,46 @@ ClientNetwork Implement
 import asyncio
 import ipaddress
 import sys
-from typing import Callable, overload, Optional
-from collections.abc import Coroutine
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Callable, overload, Optional, Union
+from collections.abc import Awaitable, Coroutine
 from typing_extensions import Literal
 
 from lagrange.info import SigInfo
 from lagrange.utils.log import log
 from lagrange.utils.network import Connection
 
-from .wtlogin.sso import SSOPacket, parse_sso_frame, parse_sso_header
+from .pending import PendingRequests
+from .wtlogin.sso import SSOPacket, parse_oicq_body, parse_sso_frame, parse_sso_header
+
+
+@dataclass
+class WriteStats:
+    """发送队列的统计数据"""
+
+    queued_bytes: int = 0  # 已入队但尚未 drain 完成的字节数
+    frames: int = 0
+    bytes: int = 0
+    flushes: int = 0
+    max_frames_per_flush: int = 0
+    drain_wait: float = 0.0  # drain 等待的总时间, 秒
+    last_drain_wait: float = 0.0
+    backpressure_waits: int = 0  # write 因超过 high water 而等待的次数
+
+    @property
+    def frames_per_flush(self) -> float:
+        return self.frames / self.flushes if self.flushes else 0.0
+
+
+def decode_sso_packet(raw: bytes, d2_key: bytes) -> tuple[int, SSOPacket]:
+    """
+    解密并解析一个 SSO 包, 可以在线程池或进程池中执行.
+    oicq body 依赖本进程的 ecdh 密钥, 由调用方在主进程中处理
+    """
+    enc_flag, _, sso_body = parse_sso_header(raw, d2_key)
+    return enc_flag, parse_sso_frame(sso_body)
 
 
 class ClientNetwork(Connection):
@@ -29,22 +60,43 @@ class ClientNetwork(Connection):
         use_v6=False,
         *,
         manual_address: Optional[tuple[str, int]] = None,
+        write_high_water: int = 4 * 1024 * 1024,
+        decode_executor: Optional[Executor] = None,
+        inline_decode_size: int = 16 * 1024,
+        buffered: bool = False,
     ):
         if not manual_address:
             host, port = self.V6UPSTREAM if use_v6 else self.V4UPSTREAM
         else:
             host, port = manual_address
-        super().__init__(host, port)
+        super().__init__(host, port, buffered=buffered)
 
         self.conn_event = asyncio.Event()
         self._using_v6 = use_v6
         self._push_store = push_store
         self._reconnect_cb = reconnect_cb
         self._disconnect_cb = disconnect_cb
-        self._wait_fut_map: dict[int, asyncio.Future[SSOPacket]] = {}
+        self.pending: PendingRequests[SSOPacket] = PendingRequests()
         self._connected = False
         self._sig = sig_info
 
+        # 发送队列: write 只负责入队, 由 _write_loop 在每个事件循环周期合并为一次 writelines
+        self.write_high_water = write_high_water
+        self.write_stats = WriteStats()
+        self._out_frames: list[bytes] = []
+        self._out_ready = asyncio.Event()
+        self._out_writable = asyncio.Event()
+        self._out_writable.set()
+        self._write_task: Optional[asyncio.Task] = None
+
+        # 大于 inline_decode_size 的包交给 decode_executor 解密解析, 按收包顺序分发
+        self.decode_executor = decode_executor
+        self.inline_decode_size = inline_decode_size
+        self._decode_queue: asyncio.Queue[Awaitable[tuple[int, SSOPacket]]] = asyncio.Queue()
+        self._decode_inflight = 0
+        self._decode_error: Optional[BaseException] = None
+        self._dispatch_task: Optional[asyncio.Task] = None
+
     @property
     def using_v6(self) -> bool:
         if not self.closed:
@@ -56,9 +108,57 @@ class ClientNetwork(Connection):
             self._writer.close()
 
     async def write(self, buf: bytes):
+        """入队待发送的数据, 队列中的数据超过 write_high_water 时等待 drain"""
         await self.conn_event.wait()
-        self.writer.write(buf)
-        await self.writer.drain()
+        while not self._out_writable.is_set():
+            self.write_stats.backpressure_waits += 1
+            await self._out_writable.wait()
+        self._out_frames.append(buf)
+        self.write_stats.queued_bytes += len(buf)
+        if self.write_stats.queued_bytes >= self.write_high_water:
+            self._out_writable.clear()
+        self._out_ready.set()
+
+    async def _write_loop(self):
+        stats = self.write_stats
+        while True:
+            await self._out_ready.wait()
+            self._out_ready.clear()
+            frames, self._out_frames = self._out_frames, []
+            if not frames:
+                continue
+            size = sum(len(i) for i in frames)
+            try:
+                self.writer.writelines(frames)
+                start = time.monotonic()
+                await self.writer.drain()
+            except (ConnectionError, OSError, RuntimeError) as e:
+                # 连接已断开, 由 read loop 处理重连, 这里丢弃本批数据
+                log.network.debug(f"write {len(frames)} frames failed: {repr(e)}")
+                self._reset_write_queue()
+                continue
+            stats.last_drain_wait = time.monotonic() - start
+            stats.drain_wait += stats.last_drain_wait
+            stats.flushes += 1
+            stats.frames += len(frames)
+            stats.bytes += size
+            stats.max_frames_per_flush = max(stats.max_frames_per_flush, len(frames))
+            stats.queued_bytes -= size
+            if stats.queued_bytes < self.write_high_water:
+                self._out_writable.set()
+
+    def _reset_write_queue(self):
+        if self._out_frames:
+            log.network.debug(f"drop {len(self._out_frames)} unsent frames")
+        self._out_frames = []
+        self.write_stats.queued_bytes = 0
+        self._out_writable.set()
+
+    def _stop_write_loop(self):
+        if self._write_task and not self._write_task.done():
+            self._write_task.cancel()
+        self._write_task = None
+        self._reset_write_queue()
 
     @overload
     async def send(
@@ -71,20 +171,41 @@ class ClientNetwork(Connection):
     async def send(self, buf: bytes, wait_seq: int, timeout: int = 10):  # type: ignore
         await self.write(buf)
         if wait_seq != -1:
-            fut: asyncio.Future[SSOPacket] = asyncio.Future()
-            self._wait_fut_map[wait_seq] = fut
-            try:
-                await asyncio.wait_for(fut, timeout=timeout)
-                return fut.result()
-            finally:
-                self._wait_fut_map.pop(wait_seq)  # noqa
+            return await self.wait_response(wait_seq, timeout)
+
+    async def wait_response(self, seq: int, timeout: float = 10) -> SSOPacket:
+        """等待已发出的包的响应, 需要在 write 之后、下一次 await 之前调用"""
+        fut = self.pending.add(seq, timeout)
+        try:
+            return await fut
+        finally:
+            self.pending.discard(seq, fut)
+
+    async def stop(self):
+        await super().stop()
+        self._reset_decode_queue()
+
+    def _reset_decode_queue(self):
+        """丢弃旧连接上还未分发的包, 避免重连后才被处理"""
+        if self._dispatch_task and not self._dispatch_task.done():
+            self._dispatch_task.cancel()
+        self._dispatch_task = None
+        queue, self._decode_queue = self._decode_queue, asyncio.Queue()
+        if self._decode_inflight:
+            log.network.debug(f"drop {self._decode_inflight} undispatched frames")
+        while not queue.empty():
+            fut = queue.get_nowait()
+            if isinstance(fut, asyncio.Future):
+                fut.cancel()
+        self._decode_inflight = 0
+        self._decode_error = None
 
     def _cancel_all_task(self):
-        for _, fut in self._wait_fut_map.items():
-            if not fut.done():
-                fut.cancel("connection closed")
+        self.pending.cancel_all("connection closed")
 
     async def on_connected(self):
+        self._stop_write_loop()
+        self._write_task = asyncio.create_task(self._write_loop(), name="network_write")
         self.conn_event.set()
         host, port = self.writer.get_extra_info("peername")[:2]  # for v6 ip
         if ipaddress.ip_address(host).version != 6 and self._using_v6:
@@ -99,11 +220,15 @@ class ClientNetwork(Connection):
     async def on_close(self):
         self.conn_event.clear()
         log.network.warning("Connection closed")
+        self._stop_write_loop()
+        self._reset_decode_queue()
         self._cancel_all_task()
         asyncio.create_task(self._disconnect_cb(False), name="disconnect_cb")
 
     async def on_error(self) -> bool:
         _, err, _ = sys.exc_info()
+        if self._decode_error:
+            err, self._decode_error = self._decode_error, None
 
         # OSError: timeout
         if isinstance(err, (asyncio.IncompleteReadError, ConnectionError, OSError)):
@@ -113,35 +238,63 @@ class ClientNetwork(Connection):
         else:
             log.network.error(f"Connection got an unexpected error: {repr(err)}")
             recover = False
+        self._stop_write_loop()
+        self._reset_decode_queue()
         self._cancel_all_task()
         asyncio.create_task(self._disconnect_cb(recover), name="disconnect_cb")
         return recover
 
     async def on_message(self, message_length: int):
-        raw = await self.reader.readexactly(message_length)
-        enc_flag, uin, sso_body = parse_sso_header(raw, self._sig.d2_key)
+        await self.on_frame(await self.reader.readexactly(message_length))
+
+    async def on_frame(self, raw: Union[bytes, memoryview]):
+        if self.decode_executor and len(raw) >= self.inline_decode_size:
+            fut = asyncio.get_running_loop().run_in_executor(
+                self.decode_executor, decode_sso_packet, bytes(raw), self._sig.d2_key
+            )
+        elif not self._decode_inflight:  # 没有排队中的包, 直接在当前协程处理
+            return await self._dispatch(*decode_sso_packet(raw, self._sig.d2_key))
+        else:  # 前面还有未解析完的大包, 排队以保持顺序
+            fut = asyncio.get_running_loop().create_future()
+            fut.set_result(decode_sso_packet(raw, self._sig.d2_key))
+
+        if not self._dispatch_task or self._dispatch_task.done():
+            self._dispatch_task = asyncio.create_task(
+                self._dispatch_loop(self._decode_queue), name="network_dispatch"
+            )
+        self._decode_inflight += 1
+        self._decode_queue.put_nowait(fut)
+
+    async def _dispatch_loop(self, queue: "asyncio.Queue[Awaitable[tuple[int, SSOPacket]]]"):
+        while True:
+            fut = await queue.get()
+            try:
+                await self._dispatch(*await fut)
+            except Exception as e:
+                # 与同步解析时一致, 交给 read loop 的 on_error 处理
+                self._decode_error = e
+                self.destroy_connection()
+            finally:
+                if queue is self._decode_queue:  # 断线后队列已被替换, 不再计数
+                    self._decode_inflight -= 1
 
-        packet = parse_sso_frame(sso_body, enc_flag == 2)
+    async def _dispatch(self, enc_flag: int, packet: SSOPacket):
+        if enc_flag == 2 and packet.cmd.find("wtlogin") == 0:
+            packet.data = parse_oicq_body(packet.data)
 
         if packet.seq > 0:  # uni rsp
             log.network.debug(
                 f"{packet.seq}({packet.ret_code})-> {packet.cmd or packet.extra}"
             )
-            if packet.ret_code != 0 and packet.seq in self._wait_fut_map:
-                return self._wait_fut_map[packet.seq].set_exception(
-                    AssertionError(packet.ret_code, packet.extra)
-                )
-            elif packet.ret_code != 0:
-                return log.network.error(
-                    f"Unexpected error on sso layer: {packet.ret_code}: {packet.extra}"
-                )
-
-            if packet.seq not in self._wait_fut_map:
+            if packet.ret_code != 0:
+                if not self.pending.reject(packet.seq, AssertionError(packet.ret_code, packet.extra)):
+                    log.network.error(
+                        f"Unexpected error on sso layer: {packet.ret_code}: {packet.extra}"
+                    )
+            elif not self.pending.resolve(packet.seq, packet):
                 log.network.warning(
                     f"Unknown packet: {packet.cmd}({packet.seq}), ignore"
                 )
-            else:
-                self._wait_fut_map[packet.seq].set_result(packet)
         elif packet.seq == 0:
             raise AssertionError(packet.ret_code, packet.extra)
         else:  # server pushed
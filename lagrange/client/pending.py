@@ -0,0 +1,113 @@
+"""
+Pending request table
+"""
+
+import asyncio
+import heapq
+from typing import Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class PendingRequests(Generic[T]):
+    """
+    以 seq 为键的等待响应表.
+    所有请求的超时共用一个 timer, 按 deadline 堆批量过期, 不再为每个请求创建 wait_for Task 与 TimerHandle
+    """
+
+    def __init__(self, resolution: float = 0.05):
+        self._resolution = resolution
+        # seq -> (future, 发出时间)
+        self._pending: dict[int, tuple[asyncio.Future[T], float]] = {}
+        # (deadline, seq, future), 已完成的项延迟删除
+        self._deadlines: list[tuple[float, int, asyncio.Future[T]]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, seq: int) -> bool:
+        return seq in self._pending
+
+    def oldest_age(self) -> float:
+        """最早的未完成请求已等待的秒数, 没有时为 0"""
+        if not self._pending:
+            return 0.0
+        _, start = next(iter(self._pending.values()))
+        return asyncio.get_running_loop().time() - start
+
+    def add(self, seq: int, timeout: float) -> asyncio.Future[T]:
+        if seq in self._pending:
+            raise ValueError(f"seq {seq} is already pending")
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        fut: asyncio.Future[T] = loop.create_future()
+        self._pending[seq] = (fut, now)
+        deadline = now + timeout
+        heapq.heappush(self._deadlines, (deadline, seq, fut))
+        if len(self._deadlines) > 2 * len(self._pending) + 64:
+            self._compact()
+        if self._timer is None or deadline < self._timer_at:
+            self._schedule(loop, deadline)
+        return fut
+
+    def discard(self, seq: int, fut: asyncio.Future[T]) -> None:
+        item = self._pending.get(seq)
+        if item and item[0] is fut:
+            del self._pending[seq]
+
+    def resolve(self, seq: int, result: T) -> bool:
+        item = self._pending.pop(seq, None)
+        if item is None:
+            return False
+        if not item[0].done():
+            item[0].set_result(result)
+        return True
+
+    def reject(self, seq: int, exc: BaseException) -> bool:
+        item = self._pending.pop(seq, None)
+        if item is None:
+            return False
+        if not item[0].done():
+            item[0].set_exception(exc)
+        return True
+
+    def cancel_all(self, msg: Optional[str] = None) -> None:
+        for fut, _ in self._pending.values():
+            if not fut.done():
+                fut.cancel(msg)
+        self._pending.clear()
+        self._deadlines.clear()
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _compact(self) -> None:
+        self._deadlines = [i for i in self._deadlines if not i[2].done()]
+        heapq.heapify(self._deadlines)
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop, when: float) -> None:
+        if self._timer:
+            self._timer.cancel()
+        self._timer_at = when
+        self._timer = loop.call_at(when, self._expire)
+
+    def _expire(self) -> None:
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        heap = self._deadlines
+        while heap and heap[0][0] <= now:
+            _, seq, fut = heapq.heappop(heap)
+            if fut.done():
+                continue
+            item = self._pending.get(seq)
+            if item and item[0] is fut:
+                del self._pending[seq]
+            fut.set_exception(asyncio.TimeoutError())
+        while heap and heap[0][2].done():
+            heapq.heappop(heap)
+        if heap:
+            # 相近的 deadline 合并到同一次唤醒中处理
+            self._schedule(loop, max(heap[0][0], now + self._resolution))
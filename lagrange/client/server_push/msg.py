@@ -21,9 +21,9 @@ from lagrange.pb.status.group import (
     PBSelfJoinInGroup,
 )
 from lagrange.pb.status.friend import PBFriendRecall, PBFriendRequest
-from lagrange.utils.binary.protobuf import proto_decode, ProtoStruct, proto_encode
+from lagrange.utils.binary.protobuf import proto_decode, ProtoStruct
 from lagrange.utils.binary.reader import Reader
-from lagrange.utils.operator import unpack_dict, timestamp
+from lagrange.utils.operator import timestamp
 
 from ..events.group import (
     BotGrayTip,
@@ -157,8 +157,6 @@ async def msg_push_handler(client: "Client", sso: SSOPacket):
                 for x in pb.body.attrs:
                     x: dict[bytes, bytes]
                     k, v = x.values()
-                    if isinstance(v, dict):
-                        v = proto_encode(v)
                     if v.isdigit():
                         attrs[k.decode()] = int(v.decode())
                     else:
@@ -281,8 +279,8 @@ async def msg_push_handler(client: "Client", sso: SSOPacket):
             return GroupMuteMember(
                 grp_id=info.into(1, int),
                 operator_uid=info.into(4, bytes).decode(),
-                target_uid=unpack_dict(info.proto, "5.3.1", b"").decode(),
-                duration=unpack_dict(info.proto, "5.3.2"),
+                target_uid=info.into((5, 3, 1), bytes, b"").decode(),
+                duration=info.into((5, 3, 2), int),
             )
         elif sub_typ == 21:  # set/unset essence msg
             pass  # todo
@@ -40,10 +40,10 @@ def build_key_exchange_request(uin: int, guid: str) -> bytes:
 
 
 def parse_key_exchange_response(response: bytes, sig: SigInfo):
-    p = proto_decode(response, 0)
+    p = proto_decode(response)
 
     share_key = ecdh["prime256v1"].exchange(p[3])
-    dec_pb = proto_decode(aes_gcm_decrypt(p[1], share_key), 0)
+    dec_pb = proto_decode(aes_gcm_decrypt(p[1], share_key))
 
     sig.exchange_key = dec_pb[1]
     sig.key_sig = dec_pb[2]
@@ -47,7 +47,7 @@ def build_ntlogin_request(
 def parse_ntlogin_response(
     response: bytes, sig: SigInfo, captcha: list
 ) -> LoginErrorCode:
-    frame = proto_decode(response, 0)
+    frame = proto_decode(response)
     rsp = NTLoginRsp.decode(aes_gcm_decrypt(frame.into(3, bytes), sig.exchange_key))
 
     if not rsp.head.error and rsp.body and rsp.body.credentials:
@@ -94,9 +94,11 @@ def build_uni_packet(
             3: bytes.fromhex(sign["extra"]),
         }
 
-    sso_header = (
-        PacketBuilder()
-        .write_u32(seq)
+    # sso_header 与 body 直接写入同一个待加密的 buffer, 长度前缀预留后回填
+    sso_packet = PacketBuilder(encrypt_key=sig_info.d2_key)
+    header_len = sso_packet.reserve_length("u32")
+    (
+        sso_packet.write_u32(seq)
         .write_u32(app_info.sub_app_id)
         .write_u32(2052)  # locale id
         .write_bytes(bytes.fromhex("020000000000000000000000"))
@@ -107,25 +109,20 @@ def build_uni_packet(
         .write_bytes(b"", "u32")
         .write_string(app_info.current_version, "u16")
         .write_bytes(proto_encode(head), "u32")
-    ).pack()
-
-    sso_packet = (
-        PacketBuilder().write_bytes(sso_header, "u32").write_bytes(body, "u32")
-    ).pack()
-
-    encrypted = qqtea_encrypt(sso_packet, sig_info.d2_key)
+    )
+    sso_packet.fill_length(header_len).write_bytes(body, "u32")
 
-    service = (
-        PacketBuilder()
-        .write_u32(12)
+    frame = PacketBuilder()
+    frame_len = frame.reserve_length("u32")
+    (
+        frame.write_u32(12)
         .write_u8(1 if sig_info.d2 else 2)
         .write_bytes(sig_info.d2, "u32")
         .write_u8(0)
         .write_string(str(uin), "u32")
-        .write_bytes(encrypted)
-    ).pack()
-
-    return PacketBuilder().write_bytes(service, "u32").pack()
+        .write_bytes(sso_packet.data)
+    )
+    return frame.fill_length(frame_len).pack()
 
 
 def decode_login_response(buf: bytes, sig: SigInfo):
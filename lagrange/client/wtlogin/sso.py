@@ -42,28 +42,30 @@ def parse_sso_header(raw: bytes, d2_key: bytes) -> tuple[int, str, bytes]:
 
 
 def parse_sso_frame(buffer: bytes, is_oicq_body=False) -> SSOPacket:
-    reader = Reader(buffer)
+    reader = Reader(buffer, zero_copy=True)
     head_len, seq, ret_code = reader.read_struct("!I2i")
     extra = reader.read_string_with_length("u32")  # extra
     cmd = reader.read_string_with_length("u32")
-    session_id = reader.read_bytes_with_length("u32")
+    session_id = bytes(reader.read_bytes_with_length("u32"))
 
     if ret_code != 0:
         return SSOPacket(seq=seq, ret_code=ret_code, session_id=session_id, extra=extra)
 
     compress_type = reader.read_u32()
-    reader.read_bytes_with_length("u32", False)
-
-    data = reader.read_bytes_with_length("u32", False)
-    if data:
-        if compress_type == 0:
-            pass
-        elif compress_type == 1:
-            data = zlib.decompress(data)
-        elif compress_type == 8:
-            data = data[4:]
-        else:
-            raise TypeError(f"Unsupported compress type {compress_type}")
+    reader.skip(reader.read_u32())
+
+    # 只在最后复制一次 body
+    view = reader.read_bytes_with_length("u32", False)
+    if not view:
+        data = b""
+    elif compress_type == 0:
+        data = bytes(view)
+    elif compress_type == 1:
+        data = zlib.decompress(view)
+    elif compress_type == 8:
+        data = bytes(view[4:])
+    else:
+        raise TypeError(f"Unsupported compress type {compress_type}")
 
     if is_oicq_body and cmd.find("wtlogin") == 0:
         data = parse_oicq_body(data)
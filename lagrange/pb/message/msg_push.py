@@ -6,11 +6,11 @@ from .heads import ContentHead, ResponseHead
 from .msg import Message
 
 
-class MsgPushBody(ProtoStruct):
+class MsgPushBody(ProtoStruct, lazy=True):
     response_head: ResponseHead = proto_field(1)
     content_head: ContentHead = proto_field(2)
     message: Optional[Message] = proto_field(3, default=None)
 
 
-class MsgPush(ProtoStruct):
+class MsgPush(ProtoStruct, lazy=True):
     body: MsgPushBody = proto_field(1)
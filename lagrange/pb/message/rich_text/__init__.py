@@ -43,7 +43,7 @@ class Elems(ProtoStruct, debug=True):
     common_elem: Optional[CommonElem] = proto_field(53, default=None)
 
 
-class RichText(ProtoStruct):
+class RichText(ProtoStruct, lazy=True):
     attrs: Optional[dict] = proto_field(1, default=None)
     content: list[Elems] = proto_field(2)
     not_online_file: Optional[dict] = proto_field(3, default=None)
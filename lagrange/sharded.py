@@ -0,0 +1,315 @@
+"""
+Spread accounts over multiple worker processes
+"""
+
+import asyncio
+import math
+import multiprocessing
+import os
+import pickle
+import threading
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Literal, Optional, Union
+
+from .utils.log import log
+
+_logger = log.fork("sharded")
+
+# 父子进程之间的消息均为 pickle 后的 tuple, 由 Connection.send_bytes 分帧
+# 父 -> 子: ("add", uin, password) ("remove", uin) ("stop",)
+# 子 -> 父: ("event", uin, event) ("removed", uin) ("metrics", {uin: metrics})
+
+
+def _send(conn: Connection, lock: threading.Lock, *msg: Any) -> bool:
+    try:
+        data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        # 事件中带有 Client/Future 等无法 pickle 的对象, 丢弃这一条, 不影响后续转发
+        _logger.error(f"drop {msg[0]} message {type(msg[-1]).__name__}: {e!r}")
+        return False
+    try:
+        with lock:
+            conn.send_bytes(data)
+        return True
+    except (OSError, ValueError):  # 对端已退出
+        return False
+
+
+def _read_forever(conn: Connection, loop: asyncio.AbstractEventLoop, on_message: Callable, on_eof: Callable):
+    """在线程中阻塞读取, 结果交给事件循环处理; Windows 的 pipe 不能注册到 selector"""
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except (EOFError, OSError):
+            break
+        loop.call_soon_threadsafe(on_message, pickle.loads(data))
+    loop.call_soon_threadsafe(on_eof)
+
+
+async def _worker(conn: Connection, accounts: list[tuple[int, str]], options: dict, event_types: list[type]):
+    from .supervisor import Supervisor
+
+    loop = asyncio.get_running_loop()
+    lock = threading.Lock()
+    stop_ev = asyncio.Event()
+    options = dict(options)
+    interval = options.pop("metrics_interval", 10.0)
+    sup = Supervisor(**options)
+
+    async def forward(client, event):
+        _send(conn, lock, "event", client.uin, event)
+
+    for typ in event_types:
+        sup.subscribe(typ, forward)
+    for uin, password in accounts:
+        sup.add_account(uin, password)
+
+    async def remove(uin: int):
+        if uin in sup.accounts:
+            await sup.remove_account(uin)
+        _send(conn, lock, "removed", uin)
+
+    def on_message(msg: tuple):
+        if msg[0] == "add":
+            if msg[1] not in sup.accounts:
+                sup.add_account(msg[1], msg[2])
+        elif msg[0] == "remove":
+            asyncio.create_task(remove(msg[1]))
+        elif msg[0] == "stop":
+            stop_ev.set()
+
+    threading.Thread(
+        target=_read_forever, args=(conn, loop, on_message, stop_ev.set), daemon=True, name="sharded_cmd"
+    ).start()
+    sup.start()
+    try:
+        while not stop_ev.is_set():
+            try:
+                await asyncio.wait_for(stop_ev.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            _send(conn, lock, "metrics", sup.metrics())
+    finally:
+        for uin in list(sup.accounts):
+            await sup.remove_account(uin)
+        await sup.stop()
+
+
+def _worker_main(conn: Connection, accounts: list[tuple[int, str]], options: dict, event_types: list[type]):
+    try:
+        asyncio.run(_worker(conn, accounts, options, event_types))
+    except KeyboardInterrupt:
+        pass
+
+
+class _Shard:
+    def __init__(self, index: int):
+        self.index = index
+        self.accounts: dict[int, str] = {}  # uin -> password
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.conn: Optional[Connection] = None
+        self.lock = threading.Lock()
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return bool(self.process and self.process.is_alive())
+
+    def send(self, *msg: Any) -> bool:
+        return bool(self.conn) and _send(self.conn, self.lock, *msg)  # type: ignore
+
+
+class ShardedHost:
+    """
+    把账号分散到多个工作进程中运行, 每个进程内部是一个 Supervisor.
+    进程之间不共享状态: 每个账号的 device.json 与 sig.bin 由所在进程通过 InfoManager 读写,
+    事件通过 pipe 转发回父进程; 工作进程异常退出后会按原分配重启
+    """
+
+    def __init__(
+        self,
+        protocol: Literal["linux", "macos", "windows"] = "linux",
+        sign_url: Optional[str] = None,
+        data_dir: Union[str, os.PathLike[str]] = "./accounts",
+        *,
+        workers: Optional[int] = None,
+        restart_delay: float = 5.0,
+        metrics_interval: float = 10.0,
+        **supervisor_options: Any,
+    ):
+        """supervisor_options 会原样传给每个进程中的 Supervisor"""
+        self.options = dict(
+            protocol=protocol,
+            sign_url=sign_url,
+            data_dir=str(data_dir),
+            metrics_interval=metrics_interval,
+            **supervisor_options,
+        )
+        self.restart_delay = restart_delay
+        self.shards = [_Shard(i) for i in range(workers or os.cpu_count() or 1)]
+        self.events: dict[type, Callable] = {}
+        self._metrics: dict[int, dict[str, Any]] = {}
+        self._moving: dict[int, tuple[_Shard, _Shard]] = {}  # 迁移中的账号 -> (源进程, 目标进程)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+        self._done: Optional[asyncio.Event] = None
+
+    def subscribe(self, event: type, handler: Callable):
+        """handler(uin, event), 在父进程中执行; 需要在 run 之前订阅, 事件对象需可 pickle"""
+        self.events[event] = handler
+
+    def metrics(self) -> dict[int, dict[str, Any]]:
+        """各账号最近一次上报的指标, 附带所在进程编号"""
+        return dict(self._metrics)
+
+    def _shard_of(self, uin: int) -> Optional[_Shard]:
+        for shard in self.shards:
+            if uin in shard.accounts:
+                return shard
+        return None
+
+    def _least_loaded(self) -> _Shard:
+        return min(self.shards, key=lambda s: len(s.accounts))
+
+    def add_account(self, uin: int, password: str = ""):
+        if self._shard_of(uin) or uin in self._moving:
+            raise ValueError(f"account {uin} already added")
+        shard = self._least_loaded()
+        shard.accounts[uin] = password
+        if shard.alive:
+            shard.send("add", uin, password)
+
+    def remove_account(self, uin: int):
+        shard = self._shard_of(uin)
+        if not shard:
+            raise KeyError(uin)
+        del shard.accounts[uin]
+        self._metrics.pop(uin, None)
+        shard.send("remove", uin)
+
+    def rebalance(self):
+        """把账号从负载高的进程迁移到负载低的进程, 旧进程保存 sig 后新进程才会启动该账号"""
+        total = sum(len(s.accounts) for s in self.shards) + len(self._moving)
+        target = math.ceil(total / len(self.shards))
+        for shard in self.shards:
+            while len(shard.accounts) > target:
+                dest = self._least_loaded()
+                if len(dest.accounts) + 1 >= len(shard.accounts):
+                    break
+                uin, password = shard.accounts.popitem()
+                dest.accounts[uin] = password
+                self._moving[uin] = (shard, dest)
+                if not shard.send("remove", uin):  # 源进程不在运行, 直接迁移
+                    self._moving.pop(uin)
+                    dest.send("add", uin, password)
+                _logger.info(f"moving {uin}: worker {shard.index} -> {dest.index}")
+
+    def _on_message(self, shard: _Shard, msg: tuple):
+        if msg[0] == "event":
+            _, uin, event = msg
+            handler = self.events.get(type(event))
+            if handler:
+                asyncio.create_task(self._run_handler(handler, uin, event))
+        elif msg[0] == "metrics":
+            for uin, m in msg[1].items():
+                m["worker"] = shard.index
+                self._metrics[uin] = m
+        elif msg[0] == "removed":
+            moving = self._moving.get(msg[1])
+            if moving and moving[0] is shard:  # 只接受源进程的确认
+                del self._moving[msg[1]]
+                dest = moving[1]
+                if msg[1] in dest.accounts:
+                    dest.send("add", msg[1], dest.accounts[msg[1]])
+
+    @staticmethod
+    async def _run_handler(handler: Callable, uin: int, event: Any):
+        try:
+            await handler(uin, event)
+        except Exception as e:
+            log.root.exception(f"Unhandled exception on task {event}", exc_info=e)
+
+    def _startup_accounts(self, shard: _Shard) -> list[tuple[int, str]]:
+        """迁入中的账号等源进程发来 removed 后再启动, 避免两个进程同时登录"""
+        return [(uin, password) for uin, password in shard.accounts.items() if uin not in self._moving]
+
+    def _spawn(self, shard: _Shard):
+        parent, child = self._ctx.Pipe()
+        shard.conn = parent
+        shard.process = self._ctx.Process(
+            target=_worker_main,
+            args=(child, self._startup_accounts(shard), self.options, list(self.events)),
+            name=f"lagrange-worker-{shard.index}",
+            daemon=True,
+        )
+        process = shard.process
+        process.start()
+        child.close()
+        threading.Thread(
+            target=_read_forever,
+            args=(
+                parent,
+                self._loop,
+                lambda msg: self._on_message(shard, msg),
+                lambda: self._on_exit(shard, process),
+            ),
+            daemon=True,
+            name=f"sharded_reader_{shard.index}",
+        ).start()
+        _logger.info(f"worker {shard.index} started with {len(shard.accounts)} accounts")
+
+    def _on_exit(self, shard: _Shard, process):
+        if process is not shard.process:
+            return
+        shard.conn = None
+        # 从该进程迁出的账号不会再收到 removed, 直接在目标进程启动
+        for uin, (src, dest) in list(self._moving.items()):
+            if src is not shard:
+                continue
+            self._moving.pop(uin)
+            if uin in dest.accounts:
+                dest.send("add", uin, dest.accounts[uin])
+        if self._stopping:
+            return
+        process.join(1)
+        shard.restarts += 1
+        delay = min(self.restart_delay * shard.restarts, 300)
+        _logger.error(f"worker {shard.index} exited ({process.exitcode}), restarting in {delay:.0f}s")
+        self._loop.call_later(delay, self._restart, shard)  # type: ignore
+
+    def _restart(self, shard: _Shard):
+        if not self._stopping:
+            self._spawn(shard)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._done = asyncio.Event()
+        self._stopping = False
+        for shard in self.shards:
+            self._spawn(shard)
+        try:
+            await self._done.wait()
+        finally:
+            await self.stop()
+
+    async def stop(self, timeout: float = 15):
+        self._stopping = True
+        for shard in self.shards:
+            shard.send("stop")
+        loop = asyncio.get_running_loop()
+        for shard in self.shards:
+            if shard.process:
+                await loop.run_in_executor(None, shard.process.join, timeout)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+        if self._done:
+            self._done.set()
+
+    def launch(self):
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            log.root.info("Program exited by user")
+        else:
+            log.root.info("Program exited normally")
@@ -0,0 +1,231 @@
+"""
+Run multiple accounts in one event loop
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Literal, Optional, Union
+
+from .client.client import Client
+from .info import InfoManager
+from .info.app import app_list
+from .utils.log import log
+from .utils.sign import sign_provider
+
+_logger = log.fork("supervisor")
+
+
+@dataclass
+class AccountStats:
+    """单个账号的运行状态"""
+
+    state: str = "pending"  # pending, login, online, offline, failed, stopped
+    logins: int = 0
+    login_failures: int = 0
+    restarts: int = 0
+    errors: int = 0
+    last_error: str = ""
+    online_since: float = 0.0
+
+
+@dataclass
+class Account:
+    uin: int
+    im: InfoManager
+    password: str = ""
+    client: Optional[Client] = None
+    stats: AccountStats = field(default_factory=AccountStats)
+    task: Optional[asyncio.Task] = None
+
+    def metrics(self) -> dict[str, Any]:
+        ret = asdict(self.stats)
+        if self.client:
+            network = self.client.network
+            ret["in_flight"] = len(network.pending)
+            ret["oldest_pending"] = network.pending.oldest_age()
+            ret["write"] = asdict(network.write_stats)
+        return ret
+
+
+class Supervisor:
+    """
+    在同一个事件循环中运行多个 Client.
+    所有账号共享 sign provider, 解包线程池与 highway 上传并发限制;
+    单个账号出错只会重启该账号, 登录按 login_interval 错开以免同时请求签名服务
+    """
+
+    def __init__(
+        self,
+        protocol: Literal["linux", "macos", "windows"] = "linux",
+        sign_url: Optional[str] = None,
+        data_dir: Union[str, os.PathLike[str]] = "./accounts",
+        *,
+        decode_executor: Optional[Executor] = None,
+        decode_workers: int = 2,
+        highway_concurrency: int = 8,
+        highway_executor: Optional[Executor] = None,
+        login_interval: float = 3.0,
+        max_concurrent_logins: int = 2,
+        restart_delay: float = 5.0,
+        max_restart_delay: float = 300.0,
+    ):
+        self.info = app_list[protocol]
+        self.sign = sign_provider(sign_url) if sign_url else None
+        self.data_dir = Path(data_dir)
+        if decode_executor is None and decode_workers > 0:
+            decode_executor = ThreadPoolExecutor(decode_workers, thread_name_prefix="lagrange-decode")
+            self._own_executor = True
+        else:
+            self._own_executor = False
+        self.decode_executor = decode_executor
+        self.highway_concurrency = highway_concurrency
+        self.highway_executor = highway_executor  # 为 None 时使用 highway 共享的默认线程池
+        self.login_interval = login_interval
+        self.max_concurrent_logins = max_concurrent_logins
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+
+        self.accounts: dict[int, Account] = {}
+        self.events: dict[Any, Callable] = {}
+        self._login_sem: Optional[asyncio.Semaphore] = None
+        self._highway_sem: Optional[asyncio.Semaphore] = None
+        self._last_login = 0.0
+
+    def add_account(
+        self,
+        uin: int,
+        password: str = "",
+        device_info_path: Optional[Union[str, os.PathLike[str]]] = None,
+        signinfo_path: Optional[Union[str, os.PathLike[str]]] = None,
+    ) -> Account:
+        if uin in self.accounts:
+            raise ValueError(f"account {uin} already added")
+        base = self.data_dir / str(uin)
+        if not (device_info_path and signinfo_path):
+            base.mkdir(parents=True, exist_ok=True)
+        im = InfoManager(uin, device_info_path or base / "device.json", signinfo_path or base / "sig.bin")
+        account = self.accounts[uin] = Account(uin, im, password)
+        if self._login_sem:  # 已经在运行
+            self._start_account(account)
+        return account
+
+    async def remove_account(self, uin: int) -> None:
+        """停止并移除账号, 退出前保存 device 与 sig_info"""
+        account = self.accounts.pop(uin)
+        if account.task and not account.task.done():
+            account.task.cancel()
+            await asyncio.gather(account.task, return_exceptions=True)
+        if account.client:
+            account.im.save_all()
+
+    def subscribe(self, event, handler):
+        """对所有账号生效, handler 的第一个参数为触发事件的 Client"""
+        self.events[event] = handler
+
+    def metrics(self) -> dict[int, dict[str, Any]]:
+        return {uin: account.metrics() for uin, account in self.accounts.items()}
+
+    async def _stagger(self):
+        """错开各账号的登录时间"""
+        wait = self._last_login + self.login_interval - time.monotonic()
+        self._last_login = max(self._last_login + self.login_interval, time.monotonic())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _new_client(self, account: Account) -> Client:
+        client = Client(account.uin, self.info, account.im.device, account.im.sig_info, self.sign)
+        client.network.decode_executor = self.decode_executor
+        client.highway.upload_limit = self._highway_sem
+        client.highway.io_executor = self.highway_executor
+        for event, handler in self.events.items():
+            client.events.subscribe(event, handler)
+        return client
+
+    async def _login(self, account: Account, client: Client) -> bool:
+        if account.im.sig_info.d2 and await client.register():
+            return True
+        if account.password:
+            return await client.login(account.password)
+        return await client.login(qrcode_path=str(self.data_dir / f"{account.uin}.png"))
+
+    async def _run_account(self, account: Account):
+        stats = account.stats
+        delay = self.restart_delay
+        while True:
+            try:
+                with account.im:
+                    await self._login_sem.acquire()  # type: ignore
+                    try:
+                        await self._stagger()
+                        stats.state = "login"
+                        account.client = client = self._new_client(account)
+                        client.connect()
+                        status = await self._login(account, client)
+                    finally:
+                        self._login_sem.release()  # type: ignore
+                stats.logins += 1
+                if not status:
+                    stats.login_failures += 1
+                    stats.state = "failed"
+                    _logger.error(f"[{account.uin}] login failed")
+                    await client.stop()
+                    return
+                stats.state = "online"
+                stats.online_since = time.time()
+                delay = self.restart_delay
+                await client.network.wait_closed()
+                stats.state = "offline"
+            except asyncio.CancelledError:
+                stats.state = "stopped"
+                if account.client:
+                    await account.client.stop()
+                raise
+            except Exception as e:
+                stats.errors += 1
+                stats.last_error = repr(e)
+                stats.state = "offline"
+                _logger.exception(f"[{account.uin}] crashed:")
+                if account.client:
+                    await account.client.stop()
+
+            stats.restarts += 1
+            _logger.warning(f"[{account.uin}] restarting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    def _start_account(self, account: Account):
+        account.task = asyncio.create_task(self._run_account(account), name=f"account_{account.uin}")
+
+    def start(self):
+        """启动所有已添加的账号, 之后 add_account 添加的账号会立即启动"""
+        self._login_sem = asyncio.Semaphore(self.max_concurrent_logins)
+        self._highway_sem = asyncio.Semaphore(self.highway_concurrency)
+        for account in self.accounts.values():
+            self._start_account(account)
+
+    async def run(self):
+        self.start()
+        try:
+            await asyncio.gather(*[a.task for a in self.accounts.values()], return_exceptions=True)  # type: ignore
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        for account in self.accounts.values():
+            if account.task and not account.task.done():
+                account.task.cancel()
+        await asyncio.gather(*[a.task for a in self.accounts.values() if a.task], return_exceptions=True)
+        if self._own_executor and self.decode_executor:
+            self.decode_executor.shutdown(wait=False)
+
+    def launch(self):
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            log.root.info("Program exited by user")
+        else:
+            log.root.info("Program exited normally")
@@ -1,12 +1,34 @@
 import struct
+from functools import lru_cache
 from typing import Union
 
-from typing_extensions import Self, TypeAlias
+from typing_extensions import Literal, Self, TypeAlias
 from typing import Optional
 
 from lagrange.utils.crypto.tea import qqtea_encrypt
 
 BYTES_LIKE: TypeAlias = Union[bytes, bytearray, memoryview]
+# (偏移, 长度前缀的 Struct, 回填时需要加上的长度)
+LengthSlot: TypeAlias = tuple[int, struct.Struct, int]
+
+_BOOL = struct.Struct(">?")
+_I8 = struct.Struct(">b")
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+_I16 = struct.Struct(">h")
+_I32 = struct.Struct(">i")
+_I64 = struct.Struct(">q")
+_FLOAT = struct.Struct(">f")
+_DOUBLE = struct.Struct(">d")
+_TLV_HEAD = struct.Struct(">HH")
+LENGTH_STRUCTS = {"u8": _U8, "u16": _U16, "u32": _U32, "u64": _U64}
+
+
+@lru_cache(maxsize=64)
+def _get_struct(struct_fmt: str) -> struct.Struct:
+    return struct.Struct(f">{struct_fmt}")
 
 
 class Builder:
@@ -29,28 +51,53 @@ class Builder:
 
     @property
     def data(self) -> bytes:
+        """设置了 encrypt_key 时每次访问都会重新加密整个 buffer, 需要多次使用请先保存"""
         if self._encrypt_key:
             return qqtea_encrypt(self._buffer, self._encrypt_key)
         return self.buffer
 
     def _pack(self, struct_fmt: str, *args) -> Self:
-        self._buffer += struct.pack(f">{struct_fmt}", *args)
+        self._buffer += _get_struct(struct_fmt).pack(*args)
         return self
 
     def pack(self, typ: Optional[int] = None) -> bytes:
+        data = self.data
         if typ is not None:
-            return struct.pack(">HH", typ, len(self.data)) + self.data
-        return self.data
+            return _TLV_HEAD.pack(typ, len(data)) + data
+        return data
+
+    def reserve_length(
+        self, prefix: Literal["u8", "u16", "u32", "u64"] = "u32", with_prefix: bool = True
+    ) -> LengthSlot:
+        """
+        先写入占位的长度前缀, 内容写完后用 fill_length 回填, 避免先构建子 Builder 再整体复制一次
+
+        Args:
+            prefix: u8/u16/u32/u64
+            with_prefix: 长度是否包含前缀自身
+        """
+        s = LENGTH_STRUCTS[prefix]
+        slot = (len(self._buffer), s, 0 if with_prefix else -s.size)
+        self._buffer += bytes(s.size)
+        return slot
+
+    def fill_length(self, slot: LengthSlot) -> Self:
+        """回填 reserve_length 预留的长度, 长度为从前缀起到当前末尾"""
+        offset, s, adjust = slot
+        s.pack_into(self._buffer, offset, len(self._buffer) - offset + adjust)
+        return self
 
     def write_bool(self, v: bool) -> Self:
-        return self._pack("?", v)
+        self._buffer += _BOOL.pack(v)
+        return self
 
     def write_byte(self, v: int) -> Self:
-        return self._pack("b", v)
+        self._buffer += _I8.pack(v)
+        return self
 
     def write_bytes(self, v: BYTES_LIKE, *, with_length: bool = False) -> Self:
         if with_length:
-            self.write_u16(len(v))
+            self._buffer += _U16.pack(len(v))
         self._buffer += v
         return self
 
@@ -61,37 +108,47 @@ class Builder:
         return self._pack(struct_fmt, *args)
 
     def write_u8(self, v: int) -> Self:
-        return self._pack("B", v)
+        self._buffer += _U8.pack(v)
+        return self
 
     def write_u16(self, v: int) -> Self:
-        return self._pack("H", v)
+        self._buffer += _U16.pack(v)
+        return self
 
     def write_u32(self, v: int) -> Self:
-        return self._pack("I", v)
+        self._buffer += _U32.pack(v)
+        return self
 
     def write_u64(self, v: int) -> Self:
-        return self._pack("Q", v)
+        self._buffer += _U64.pack(v)
+        return self
 
     def write_i8(self, v: int) -> Self:
-        return self._pack("b", v)
+        self._buffer += _I8.pack(v)
+        return self
 
     def write_i16(self, v: int) -> Self:
-        return self._pack("h", v)
+        self._buffer += _I16.pack(v)
+        return self
 
     def write_i32(self, v: int) -> Self:
-        return self._pack("i", v)
+        self._buffer += _I32.pack(v)
+        return self
 
     def write_i64(self, v: int) -> Self:
-        return self._pack("q", v)
+        self._buffer += _I64.pack(v)
+        return self
 
     def write_float(self, v: float) -> Self:
-        return self._pack("f", v)
+        self._buffer += _FLOAT.pack(v)
+        return self
 
     def write_double(self, v: float) -> Self:
-        return self._pack("d", v)
+        self._buffer += _DOUBLE.pack(v)
+        return self
 
     def write_tlv(self, *tlvs: bytes) -> Self:
         self.write_u16(len(tlvs))
         for v in tlvs:
-            self.write_bytes(v)
+            self._buffer += v
         return self
@@ -1,6 +1,7 @@
-from typing import Union, TypeVar, TYPE_CHECKING, cast
+import struct
+from typing import Any, Callable, Optional, Union, TypeVar, get_args, get_origin
 from collections.abc import Mapping, Sequence
-from typing_extensions import Self, TypeAlias
+from typing_extensions import Literal, Self, TypeAlias
 
 from lagrange.utils.binary.builder import Builder
 from lagrange.utils.binary.reader import Reader
@@ -18,21 +19,191 @@ ProtoEncodable: TypeAlias = Union[
 TProtoEncodable = TypeVar("TProtoEncodable", bound="ProtoEncodable")
 
 
+_MISSING: Any = object()
+
+
 class ProtoDecoded:
+    """
+    proto_decode 的结果, 只包含一层字段, 嵌套消息保持为 bytes.
+    into() 按路径逐层解码, 并根据类型提示决定叶子节点是否继续解码
+    """
+
     def __init__(self, proto: Proto):
         self.proto = proto
 
     def __getitem__(self, item: int) -> "ProtoEncodable":
         return self.proto[item]
 
-    def into(self, field: Union[int, tuple[int, ...]], tp: type[TProtoEncodable]) -> TProtoEncodable:
-        if isinstance(field, int):
-            return self.proto[field]  # type: ignore
-        else:
-            data = self.proto
-            for f in field:
-                data = data[f]  # type: ignore
-            return data # type: ignore
+    def into(
+        self,
+        field: Union[int, tuple[int, ...]],
+        tp: type[TProtoEncodable],
+        default: Any = _MISSING,
+    ) -> TProtoEncodable:
+        """
+        Args:
+            field: tag 或 tag 路径, 路径中间的节点视为嵌套消息
+            tp: 叶子节点的类型, 如 bytes, int, dict[int, bytes], list[dict[int, bytes]]
+            default: 路径不存在时的返回值, 不提供则抛出 KeyError
+        """
+        data: Any = self.proto
+        try:
+            for f in (field,) if isinstance(field, int) else field:
+                if isinstance(data, (bytes, bytearray)):
+                    data = proto_decode(data).proto
+                data = data[f]
+        except (KeyError, IndexError):
+            if default is _MISSING:
+                raise
+            return default
+        return _apply_hint(data, tp)
+
+
+def _apply_hint(value: Any, tp: Any) -> Any:
+    """按类型提示转换 proto_decode 得到的原始值, 只有提示为 dict 时才解码嵌套消息"""
+    origin = get_origin(tp) or tp
+    args = get_args(tp)
+    if origin is list:
+        items = value if isinstance(value, list) else [value]
+        return [_apply_hint(v, args[0]) for v in items] if args else items
+    elif isinstance(value, list):
+        return [_apply_hint(v, tp) for v in value]
+    elif isinstance(value, (bytes, bytearray)):
+        if origin is dict:
+            value = proto_decode(value).proto
+        elif origin is str:
+            return value.decode(errors="ignore")
+    if origin is dict and args and isinstance(value, dict):
+        return {k: _apply_hint(v, args[1]) for k, v in value.items()}
+    return value
+
+
+def read_varint_at(buf: bytes, pos: int) -> tuple[int, int]:
+    """从 buf[pos] 开始读取一个 varint, 返回 (value, 新的 pos)"""
+    byte = buf[pos]
+    if byte < 128:
+        return byte, pos + 1
+    value = byte & 127
+    shift = 7
+    while True:
+        pos += 1
+        byte = buf[pos]
+        value |= (byte & 127) << shift
+        if byte < 128:
+            return value, pos + 1
+        shift += 7
+
+
+def zigzag_encode(v: int) -> int:
+    return v << 1 if v >= 0 else ((-v) << 1) - 1
+
+
+def zigzag_decode(v: int) -> int:
+    return (v >> 1) ^ -(v & 1)
+
+
+def _to_signed64(v: int) -> int:
+    return v - (1 << 64) if v >= 1 << 63 else v
+
+
+ScalarType: TypeAlias = Literal[
+    "int32",
+    "int64",
+    "uint32",
+    "uint64",
+    "sint32",
+    "sint64",
+    "bool",
+    "fixed32",
+    "fixed64",
+    "sfixed32",
+    "sfixed64",
+    "float",
+    "double",
+]
+
+
+class Fixed32(bytes):
+    """已编码的 4 字节小端数据, 以 wire type 5 写出"""
+
+
+class Fixed64(bytes):
+    """已编码的 8 字节小端数据, 以 wire type 1 写出"""
+
+
+class ScalarSpec:
+    """protobuf 标量类型的编解码方式"""
+
+    __slots__ = ("name", "wire_type", "to_wire", "from_wire", "_struct")
+
+    def __init__(
+        self,
+        name: str,
+        wire_type: int,
+        to_wire: Optional[Callable[[Any], int]] = None,
+        from_wire: Optional[Callable[[int], Any]] = None,
+        fmt: str = "",
+    ):
+        self.name = name
+        self.wire_type = wire_type
+        self.to_wire = to_wire
+        self.from_wire = from_wire
+        self._struct = struct.Struct(f"<{fmt}") if fmt else None
+
+    @property
+    def is_identity(self) -> bool:
+        """编码时无需转换 (uint32/uint64)"""
+        return self._struct is None and self.to_wire is None
+
+    def encode(self, v: Any) -> Any:
+        if self._struct is None:
+            return self.to_wire(v) if self.to_wire else v
+        return (Fixed32 if self.wire_type == 5 else Fixed64)(self._struct.pack(v))
+
+    def decode_fixed(self, raw: bytes) -> Any:
+        return self._struct.unpack(raw)[0]  # type: ignore
+
+    def decode_varint(self, v: int) -> Any:
+        return self.from_wire(v) if self.from_wire else v
+
+    def encode_packed(self, values: list) -> bytes:
+        if self._struct is not None:
+            return struct.pack(f"<{len(values)}{self._struct.format[1:]}", *values)
+        buf = bytearray()
+        for v in values:
+            v = self.to_wire(v) if self.to_wire else v
+            while v > 127:
+                buf.append((v & 127) | 128)
+                v >>= 7
+            buf.append(v)
+        return bytes(buf)
+
+    def decode_packed(self, raw: bytes) -> list:
+        if self._struct is not None:
+            return list(struct.unpack(f"<{len(raw) // self._struct.size}{self._struct.format[1:]}", raw))
+        ret = []
+        pos, end = 0, len(raw)
+        while pos < end:
+            v, pos = read_varint_at(raw, pos)
+            ret.append(self.from_wire(v) if self.from_wire else v)
+        return ret
+
+
+SCALAR_TYPES: dict[str, ScalarSpec] = {
+    "int32": ScalarSpec("int32", 0, lambda v: v & 0xFFFFFFFFFFFFFFFF, _to_signed64),
+    "int64": ScalarSpec("int64", 0, lambda v: v & 0xFFFFFFFFFFFFFFFF, _to_signed64),
+    "uint32": ScalarSpec("uint32", 0),
+    "uint64": ScalarSpec("uint64", 0),
+    "sint32": ScalarSpec("sint32", 0, zigzag_encode, zigzag_decode),
+    "sint64": ScalarSpec("sint64", 0, zigzag_encode, zigzag_decode),
+    "bool": ScalarSpec("bool", 0, int, bool),
+    "fixed32": ScalarSpec("fixed32", 5, fmt="I"),
+    "fixed64": ScalarSpec("fixed64", 1, fmt="Q"),
+    "sfixed32": ScalarSpec("sfixed32", 5, fmt="i"),
+    "sfixed64": ScalarSpec("sfixed64", 1, fmt="q"),
+    "float": ScalarSpec("float", 5, fmt="f"),
+    "double": ScalarSpec("double", 1, fmt="d"),
+}
 
 
 class ProtoBuilder(Builder):
@@ -63,17 +234,7 @@ class ProtoBuilder(Builder):
 
 class ProtoReader(Reader):
     def read_varint(self) -> int:
-        value = 0
-        count = 0
-
-        while True:
-            byte = self.read_u8()
-            value |= (byte & 127) << (count * 7)
-            count += 1
-
-            if (byte & 128) <= 0:
-                break
-
+        value, self._pos = read_varint_at(self._buffer, self._pos)
         return value
 
     def read_length_delimited(self) -> bytes:
@@ -84,75 +245,186 @@ class ProtoReader(Reader):
         return data
 
 
-def _encode(builder: ProtoBuilder, tag: int, value: ProtoEncodable):
-    if value is None:
-        return
-
-    if isinstance(value, int):
-        wire_type = 0
-    elif isinstance(value, bool):
-        wire_type = 0
-    elif isinstance(value, float):
-        wire_type = 1
-    elif isinstance(value, (str, bytes, bytearray, dict)):
-        wire_type = 2
-    else:
-        raise Exception("Unsupported wire type in protobuf")
-
-    head = int(tag) << 3 | wire_type
-    builder.write_varint(head)
-
-    if wire_type == 0:
-        if isinstance(value, bool):
-            value = 1 if value else 0
-        if TYPE_CHECKING:
-            assert isinstance(value, int)
-        if value >= 0:
-            builder.write_varint(value)
+def _varint_size(v: int) -> int:
+    return (v.bit_length() + 6) // 7 or 1
+
+
+def _write_varint_at(buf: bytearray, pos: int, v: int) -> int:
+    while v > 127:
+        buf[pos] = (v & 127) | 128
+        v >>= 7
+        pos += 1
+    buf[pos] = v
+    return pos + 1
+
+
+# entry kinds of an encode plan
+_KIND_VARINT = 0
+_KIND_BYTES = 1
+_KIND_MESSAGE = 2
+_KIND_RAW = 3
+
+# value kinds, looked up by exact type
+_V_VARINT = 0
+_V_STR = 1
+_V_BYTES = 2
+_V_MESSAGE = 3
+_V_FIXED32 = 4
+_V_FIXED64 = 5
+_V_DOUBLE = 6
+
+_VALUE_KINDS: dict[type, int] = {
+    int: _V_VARINT,
+    bool: _V_VARINT,
+    str: _V_STR,
+    bytes: _V_BYTES,
+    bytearray: _V_BYTES,
+    memoryview: _V_BYTES,
+    dict: _V_MESSAGE,
+    Fixed32: _V_FIXED32,
+    Fixed64: _V_FIXED64,
+    float: _V_DOUBLE,
+}
+_DOUBLE = struct.Struct("<d")
+
+_EncodePlan: TypeAlias = tuple[int, list[tuple[int, int, Any]]]
+
+
+def register_message_type(typ: type) -> None:
+    """注册一个以 _proto_items() 提供字段的消息类型"""
+    _VALUE_KINDS[typ] = _V_MESSAGE
+
+
+def _value_kind(v: Any) -> int:
+    if isinstance(v, (Fixed32, Fixed64)):
+        return _V_FIXED32 if isinstance(v, Fixed32) else _V_FIXED64
+    elif isinstance(v, int):
+        return _V_VARINT
+    elif isinstance(v, str):
+        return _V_STR
+    elif isinstance(v, (bytes, bytearray, memoryview)):
+        return _V_BYTES
+    elif isinstance(v, dict) or hasattr(v, "_proto_items"):
+        return _V_MESSAGE
+    elif isinstance(v, float):
+        return _V_DOUBLE
+    raise Exception("Unsupported wire type in protobuf")
+
+
+def _plan_message(msg: Any, memo: dict[int, _EncodePlan]) -> _EncodePlan:
+    """
+    第一遍: 计算消息的编码长度, 并把字段展开为 (head, kind, payload) 列表供第二遍直接写入.
+    嵌套消息的结果按对象缓存, 每个子树只计算一次
+    """
+    if (plan := memo.get(id(msg))) is not None:
+        return plan
+    items = msg.items() if isinstance(msg, dict) else msg._proto_items()
+    entries: list[tuple[int, int, Any]] = []
+    size = 0
+    for tag, value in items:
+        for v in value if isinstance(value, list) else (value,):
+            if v is None:
+                continue
+            kind = _VALUE_KINDS.get(type(v))
+            if kind is None:
+                kind = _value_kind(v)
+            if kind == _V_VARINT:
+                v = int(v)
+                if v < 0:  # two's complement, int64
+                    v &= 0xFFFFFFFFFFFFFFFF
+                head = tag << 3
+                entries.append((head, _KIND_VARINT, v))
+                size += _varint_size(head) + _varint_size(v)
+                continue
+            elif kind == _V_MESSAGE:
+                sub = _plan_message(v, memo)
+                head = tag << 3 | 2
+                entries.append((head, _KIND_MESSAGE, sub))
+                size += _varint_size(head) + _varint_size(sub[0]) + sub[0]
+                continue
+            elif kind == _V_STR:
+                v = v.encode("utf-8")
+            elif kind != _V_BYTES:
+                if kind == _V_DOUBLE:
+                    v = _DOUBLE.pack(v)
+                head = tag << 3 | (5 if kind == _V_FIXED32 else 1)
+                entries.append((head, _KIND_RAW, v))
+                size += _varint_size(head) + len(v)
+                continue
+            head = tag << 3 | 2
+            entries.append((head, _KIND_BYTES, v))
+            size += _varint_size(head) + _varint_size(len(v)) + len(v)
+    plan = memo[id(msg)] = (size, entries)
+    return plan
+
+
+def _write_message(buf: bytearray, pos: int, entries: list[tuple[int, int, Any]]) -> int:
+    """第二遍: 按 plan 直接写入预分配的 buffer"""
+    for head, kind, payload in entries:
+        pos = _write_varint_at(buf, pos, head)
+        if kind == _KIND_VARINT:
+            pos = _write_varint_at(buf, pos, payload)
+        elif kind == _KIND_BYTES:
+            pos = _write_varint_at(buf, pos, len(payload))
+            buf[pos : pos + len(payload)] = payload
+            pos += len(payload)
+        elif kind == _KIND_RAW:
+            buf[pos : pos + len(payload)] = payload
+            pos += len(payload)
         else:
-            raise NotImplementedError
-    elif wire_type == 1:
-        raise NotImplementedError
-    elif wire_type == 2:
-        if isinstance(value, dict):
-            value = proto_encode(value)
-        if TYPE_CHECKING:
-            value = cast(LengthDelimited, value)
-        builder.write_length_delimited(value)
-    else:
-        raise AssertionError
-
-
-def proto_decode(data: bytes, max_layer=-1) -> ProtoDecoded:
-    reader = ProtoReader(data)
-    proto = {}
-
-    while reader.remain > 0:
-        leaf = reader.read_varint()
+            size, sub = payload
+            pos = _write_varint_at(buf, pos, size)
+            pos = _write_message(buf, pos, sub)
+    return pos
+
+
+def encode_message(msg: Any) -> bytes:
+    """
+    编码 dict 或 ProtoStruct, 先计算全部长度再一次性写入同一个 bytearray, 嵌套消息不会重复序列化
+    """
+    size, entries = _plan_message(msg, {})
+    buf = bytearray(size)
+    _write_message(buf, 0, entries)
+    return bytes(buf)
+
+
+def proto_decode(data: bytes, max_layer: int = 0) -> ProtoDecoded:
+    """
+    无 schema 解码, 只解析一层, length-delimited 字段原样保留为 bytes.
+    不再对每个 bytes 字段 try/except 试探是否为嵌套消息, 需要嵌套内容时使用 ProtoDecoded.into 指定路径与类型.
+    max_layer 仅为兼容旧调用保留, 已不再使用
+    """
+    proto: Proto = {}
+    pos, end = 0, len(data)
+
+    while pos < end:
+        leaf, pos = read_varint_at(data, pos)
         tag = leaf >> 3
         wire_type = leaf & 0b111
 
         assert tag > 0, f"Invalid tag: {tag}"
 
         if wire_type == 0:
-            value = reader.read_varint()
+            value, pos = read_varint_at(data, pos)
         elif wire_type == 2:
-            value = reader.read_length_delimited()
-
-            if max_layer > 0 or max_layer < 0 and len(value) > 1:
-                try:  # serialize nested
-                    value = proto_decode(value, max_layer - 1).proto
-                except Exception:
-                    pass
+            length, pos = read_varint_at(data, pos)
+            value = data[pos : pos + length]
+            pos += length
         elif wire_type == 5:
-            value = reader.read_u32()
+            value = int.from_bytes(data[pos : pos + 4], "big")
+            pos += 4
+        elif wire_type == 1:
+            value = int.from_bytes(data[pos : pos + 8], "little")
+            pos += 8
         else:
             raise AssertionError(wire_type)
+        if pos > end:
+            raise ValueError("length of data does not match")
 
         if tag in proto:  # repeated elem
             if not isinstance(proto[tag], list):
                 proto[tag] = [proto[tag]]
-            proto[tag].append(value)
+            proto[tag].append(value)  # type: ignore
         else:
             proto[tag] = value
 
@@ -160,15 +432,4 @@ def proto_decode(data: bytes, max_layer=-1) -> ProtoDecoded:
 
 
 def proto_encode(proto: Proto) -> bytes:
-    builder = ProtoBuilder()
-
-    for tag in proto:
-        value = proto[tag]
-
-        if isinstance(value, list):
-            for i in value:
-                _encode(builder, tag, i)
-        else:
-            _encode(builder, tag, value)
-
-    return bytes(builder.data)
+    return encode_message(proto)
@@ -1,15 +1,28 @@
 import sys
 from dataclasses import MISSING
 from types import GenericAlias
-from typing import cast, TypeVar, Union, Any, Callable, overload, get_origin, get_args, ForwardRef
+from typing import TypeVar, Union, Any, Callable, overload, get_origin, get_args, ForwardRef
 from collections.abc import Mapping
 from typing_extensions import Self, TypeAlias, dataclass_transform
 from typing import Optional, ClassVar
 import typing
 
-from .coder import Proto, proto_decode, proto_encode
+from lagrange.utils.log import log
+
+from .coder import (
+    SCALAR_TYPES,
+    Proto,
+    ScalarSpec,
+    ScalarType,
+    encode_message,
+    proto_decode,
+    read_varint_at,
+    register_message_type,
+)
 from .util import eval_type
 
+_logger = log.fork("protobuf")
+
 _ProtoTypes = Union[str, list, dict, bytes, int, float, bool, "ProtoStruct"]
 
 T = TypeVar("T", bound=_ProtoTypes)
@@ -29,12 +42,23 @@ class ProtoField:
     name: str
     type: Any
 
-    def __init__(self, tag: int, default: Any, default_factory: Any):
+    def __init__(
+        self,
+        tag: int,
+        default: Any,
+        default_factory: Any,
+        proto_type: Optional[ScalarType] = None,
+        packed: bool = False,
+    ):
         if tag <= 0:
             raise ValueError("Tag must be a positive integer")
+        if proto_type is not None and proto_type not in SCALAR_TYPES:
+            raise ValueError(f"Unknown proto_type: {proto_type}")
         self.tag = tag
         self.default = default
         self.default_factory = default_factory
+        self.proto_type = proto_type
+        self.packed = packed
         self._unevaluated = False
 
     def ensure_annotation(self, name: str, type_: Any) -> None:
@@ -58,6 +82,39 @@ class ProtoField:
             return get_args(self.type)[0]
         return self.type
 
+    @property
+    def element_type(self) -> tuple[Any, bool]:
+        """(元素类型, 是否 repeated)"""
+        typ = self.type_without_optional
+        if typ is list:
+            return Any, True
+        elif isinstance(typ, GenericAlias) and get_origin(typ) is list:
+            return get_args(typ)[0], True
+        return typ, False
+
+    @property
+    def scalar(self) -> Optional[ScalarSpec]:
+        """声明的标量编码方式, float 默认为 double, 其余未声明的类型沿用默认的 varint/length-delimited"""
+        if self.proto_type is not None:
+            return SCALAR_TYPES[self.proto_type]
+        elif self.element_type[0] is float:
+            return SCALAR_TYPES["double"]
+        return None
+
+    @property
+    def packed_scalar(self) -> Optional[ScalarSpec]:
+        """repeated 数值字段在遇到 packed 数据时使用的解码方式"""
+        typ, repeated = self.element_type
+        if not repeated:
+            return None
+        if (spec := self.scalar) is not None:
+            return spec
+        elif typ is int:
+            return SCALAR_TYPES["int64" if self.packed else "uint64"]
+        elif typ is bool:
+            return SCALAR_TYPES["bool"]
+        return None
+
 
 @overload  # `default` and `default_factory` are optional and mutually exclusive.
 def proto_field(
@@ -68,6 +125,8 @@ def proto_field(
     repr: bool = True,
     metadata: Optional[Mapping[Any, Any]] = None,
     kw_only: bool = ...,
+    proto_type: Optional[ScalarType] = None,
+    packed: bool = False,
 ) -> T:
     ...
 
@@ -81,6 +140,8 @@ def proto_field(
     repr: bool = True,
     metadata: Optional[Mapping[Any, Any]] = None,
     kw_only: bool = ...,
+    proto_type: Optional[ScalarType] = None,
+    packed: bool = False,
 ) -> T:
     ...
 
@@ -93,6 +154,8 @@ def proto_field(
     repr: bool = True,
     metadata: Optional[Mapping[Any, Any]] = None,
     kw_only: bool = ...,
+    proto_type: Optional[ScalarType] = None,
+    packed: bool = False,
 ) -> Any:
     ...
 
@@ -106,8 +169,14 @@ def proto_field(
     repr: bool = True,
     metadata: Optional[Mapping[Any, Any]] = None,
     kw_only: bool = False,
+    proto_type: Optional[ScalarType] = None,
+    packed: bool = False,
 ) -> "Any":
-    return ProtoField(tag, default, default_factory)
+    """
+    proto_type: 指定标量的 protobuf 类型 (sint64, fixed32, float ...), 未指定时 int 按 varint, float 按 double 处理
+    packed: repeated 数值字段编码为 packed 格式, 解码时总是兼容 packed 与非 packed
+    """
+    return ProtoField(tag, default, default_factory, proto_type, packed)
 
 
 def _decode(typ: type[_ProtoTypes], raw):
@@ -168,13 +237,143 @@ def check_type(value: Any, typ: Any) -> bool:
     return True if value is None else False  # proto3 std
 
 
+def _field_converter(typ: Any) -> Optional[Callable[[Any], Any]]:
+    """compiled decoder 使用的取值转换, 返回 None 表示原样保存"""
+    if isinstance(typ, type) and issubclass(typ, ProtoStruct):
+        return typ.decode
+    elif typ is str:
+        return lambda raw: str(raw, "utf-8", "ignore")
+    elif typ is dict:
+        return lambda raw: proto_decode(raw).proto
+    elif typ is bool:
+        return lambda raw: raw == 1
+    return None
+
+
+def _lazy_converter(typ: Any) -> Optional[Callable[[Any], Any]]:
+    """可以延迟到首次访问时再解码的类型, 输入为 memoryview; 嵌套消息是否 lazy 由其自身的声明决定"""
+    if isinstance(typ, type) and issubclass(typ, ProtoStruct):
+        return lambda raw: typ._decode_compiled(raw if typ.__proto_lazy__ else bytes(raw), typ.__proto_lazy__)
+    elif typ is dict:
+        return lambda raw: proto_decode(bytes(raw)).proto
+    return None
+
+
+class _LazyField:
+    """
+    lazy 模式下嵌套字段的描述符, 首次访问时解码并缓存到实例 __dict__ 中.
+    非数据描述符: 赋值直接写入实例 __dict__, 之后的访问与编码都以 __dict__ 为准
+    """
+
+    __slots__ = ("field", "conv", "repeated")
+
+    def __init__(self, field: ProtoField, conv: Callable[[Any], Any], repeated: bool):
+        self.field = field
+        self.conv = conv
+        self.repeated = repeated
+
+    def __get__(self, inst: Optional["ProtoStruct"], owner: Any = None) -> Any:
+        if inst is None:
+            return self.field
+        pending = inst.__dict__.get("_proto_pending")
+        if not pending or self.field.name not in pending:
+            raise AttributeError(self.field.name)
+        raw = pending.pop(self.field.name)
+        value = [self.conv(r) for r in raw] if self.repeated else self.conv(raw)
+        inst.__dict__[self.field.name] = value
+        return value
+
+
+def _field_encoder(field: ProtoField) -> Optional[Callable[[Any], Any]]:
+    """按声明的 proto_type/packed 生成编码前的取值转换"""
+    typ, repeated = field.element_type
+    if repeated and field.packed:
+        packed = field.packed_scalar
+        if packed is None:
+            raise TypeError(f"packed field '{field.name}' must be a list of int, float or bool")
+        return lambda v: packed.encode_packed(v) if v else None
+    spec = field.scalar
+    if field.proto_type is None or spec is None or spec.is_identity:
+        return None
+    if repeated:
+        return lambda v: None if v is None else [spec.encode(x) for x in v]
+    return lambda v: None if v is None else spec.encode(v)
+
+
+def _encode_value(value: Any, tf: Optional[Callable[[Any], Any]]) -> Any:
+    return value if tf is None else tf(value)
+
+
+def _scalar_from_raw(field: ProtoField, raw: Any) -> Any:
+    """validated 路径下把 proto_decode 的原始值按声明的标量类型转换"""
+    spec, packed = field.scalar, field.packed_scalar
+    if spec is None and packed is None:
+        return raw
+
+    def conv(v: Any) -> Any:
+        if spec is None or isinstance(v, bytes):
+            return v
+        elif spec.wire_type == 5:
+            return spec.decode_fixed(v.to_bytes(4, "big"))
+        elif spec.wire_type == 1:
+            return spec.decode_fixed(v.to_bytes(8, "little"))
+        return spec.decode_varint(v)
+
+    ret = []
+    for v in raw if isinstance(raw, list) else [raw]:
+        if isinstance(v, bytes) and packed is not None:
+            ret.extend(packed.decode_packed(v))
+        else:
+            ret.append(conv(v))
+    if isinstance(raw, list) or (packed is not None and isinstance(raw, bytes)):
+        return ret
+    return ret[0]
+
+
+class _DecodePlan:
+    __slots__ = ("tags", "fields")
+
+    def __init__(self, cls: type["ProtoStruct"]):
+        # tag -> (name, converter, repeated, lazy, fixed decoder, packed decoder)
+        self.tags: dict[int, tuple[str, Optional[Callable[[Any], Any]], bool, bool, Any, Any]] = {}
+        # (name, default, default_factory) in declaration order
+        self.fields: list[tuple[str, Any, Any]] = []
+        for name, field in cls.__proto_fields__.items():
+            typ, repeated = field.element_type
+            self.fields.append((name, field.default, field.default_factory))
+            if field.tag in self.tags:  # 重复的 tag 只由第一个字段接收
+                continue
+            lazy = _lazy_converter(typ) if cls.__proto_lazy__ else None
+            if lazy is not None:
+                setattr(cls, name, _LazyField(field, lazy, repeated))
+            spec, packed = field.scalar, field.packed_scalar
+            self.tags[field.tag] = (
+                name,
+                spec.decode_varint if spec is not None and spec.from_wire else _field_converter(typ),
+                repeated,
+                lazy is not None,
+                spec.decode_fixed if spec is not None and spec.wire_type != 0 else None,
+                packed.decode_packed if packed is not None else None,
+            )
+
+
 _unevaluated_classes: set[type["ProtoStruct"]] = set()
+_decode_validation = False
+
+
+def set_decode_validation(enabled: bool) -> None:
+    """开启后所有 ProtoStruct 都会走旧的逐字段类型检查解码路径, 用于调试"""
+    global _decode_validation
+    _decode_validation = enabled
 
 
 @dataclass_transform(kw_only_default=True, field_specifiers=(proto_field,))
 class ProtoStruct:
     __proto_fields__: ClassVar[dict[str, ProtoField]]
     __proto_debug__: ClassVar[bool]
+    __proto_decoder__: ClassVar[Optional[_DecodePlan]]
+    __proto_encoder__: ClassVar[Optional[list[tuple[int, str, Optional[Callable[[Any], Any]]]]]]
+    __proto_lazy__: ClassVar[bool]
 
     def __init__(self, __from_raw: bool = False, /, **kwargs):
         undefined_params: list[ProtoField] = []
@@ -182,7 +381,7 @@ class ProtoStruct:
             if name in kwargs:
                 value = kwargs.pop(name)
                 if __from_raw:
-                    value = _decode(field.type_without_optional, value)
+                    value = _decode(field.type_without_optional, _scalar_from_raw(field, value))
                 if not check_type(value, field.type):
                     raise TypeError(
                         f"'{value}' is not a instance of type '{field.type}'"
@@ -244,13 +443,27 @@ class ProtoStruct:
                 field._unevaluated = False
             except NameError:
                 pass
+        cls.__proto_decoder__ = None
+
+    @classmethod
+    def _compile_decoder(cls) -> Optional[_DecodePlan]:
+        if any(field._unevaluated for field in cls.__proto_fields__.values()):
+            return None
+        cls.__proto_decoder__ = _DecodePlan(cls)
+        return cls.__proto_decoder__
 
     def __init_subclass__(cls, **kwargs):
         cls.__proto_debug__ = kwargs.pop("debug") if "debug" in kwargs else False
+        cls.__proto_lazy__ = kwargs.pop("lazy") if "lazy" in kwargs else False
+        cls.__proto_decoder__ = None
+        cls.__proto_encoder__ = None
         cls._process_field()
+        register_message_type(cls)
         super().__init_subclass__(**kwargs)
 
     def __repr__(self) -> str:
+        for name in list(self.__dict__.get("_proto_pending", ())):
+            getattr(self, name)
         attrs = ""
         for k, v in vars(self).items():
             if k.startswith("_"):
@@ -258,30 +471,149 @@ class ProtoStruct:
             attrs += f"{k}={v!r}, "
         return f"{self.__class__.__name__}({attrs[:-2]})"
 
-    def encode(self) -> bytes:
-        pb_dict: NT = {}
-
-        def _encode(v: _ProtoTypes) -> NT:
-            if isinstance(v, ProtoStruct):
-                v = v.encode()
-            return v  # type: ignore
+    @classmethod
+    def _compile_encoder(cls) -> list[tuple[int, str, Optional[Callable[[Any], Any]]]]:
+        fields: list[tuple[int, str, Optional[Callable[[Any], Any]]]] = []
+        tags: set[int] = set()
+        for name, field in cls.__proto_fields__.items():
+            if field.tag in tags:
+                raise ValueError(f"duplicate tag: {field.tag}")
+            tags.add(field.tag)
+            fields.append((field.tag, name, _field_encoder(field)))
+        cls.__proto_encoder__ = fields
+        return fields
+
+    def _proto_items(self) -> list[tuple[int, Any]]:
+        fields = self.__class__.__dict__["__proto_encoder__"] or self._compile_encoder()
+        attrs = self.__dict__
+        pending = attrs.get("_proto_pending")
+        if pending:  # lazy 字段未被访问或赋值过, 直接写回原始数据
+            return [
+                (
+                    tag,
+                    pending[name] if name in pending and name not in attrs else _encode_value(getattr(self, name), tf),
+                )
+                for tag, name, tf in fields
+            ]
+        return [(tag, getattr(self, name) if tf is None else tf(getattr(self, name))) for tag, name, tf in fields]
 
-        for name, field in self.__proto_fields__.items():
-            tag = field.tag
-            if tag in pb_dict:
-                raise ValueError(f"duplicate tag: {tag}")
-            value: _ProtoTypes = getattr(self, name)
-            if isinstance(value, list):
-                pb_dict[tag] = [_encode(v) for v in value]
-            else:
-                pb_dict[tag] = _encode(value)
-        return proto_encode(cast(Proto, pb_dict))
+    def encode(self) -> bytes:
+        return encode_message(self)
 
     @classmethod
     def decode(cls, data: bytes) -> Self:
         if not data:
             return None  # type: ignore
-        pb_dict: Proto = proto_decode(data, 0).proto
+        if _decode_validation:
+            return cls._decode_validated(data)
+        return cls._decode_compiled(data, cls.__proto_lazy__)
+
+    @classmethod
+    def _decode_compiled(cls, data: Union[bytes, memoryview], lazy: bool) -> Self:
+        """
+        lazy 模式下在 memoryview 上解析, 嵌套消息只保存切片, 首次访问对应属性时才解码
+        """
+        if not data:
+            return None  # type: ignore
+        plan = cls.__dict__["__proto_decoder__"] or cls._compile_decoder()
+        if plan is None:
+            return cls._decode_validated(bytes(data))
+        if lazy and not isinstance(data, memoryview):
+            data = memoryview(data)
+
+        tags = plan.tags
+        values: dict[str, Any] = {}
+        pending: dict[str, Any] = {}
+        unhandled: Optional[dict[int, Any]] = {} if cls.__proto_debug__ else None
+        pos, end = 0, len(data)
+        while pos < end:
+            leaf, pos = read_varint_at(data, pos)
+            tag = leaf >> 3
+            wire_type = leaf & 0b111
+
+            assert tag > 0, f"Invalid tag: {tag}"
+
+            if wire_type == 0:
+                value, pos = read_varint_at(data, pos)
+            elif wire_type == 2:
+                length, pos = read_varint_at(data, pos)
+                if pos + length > end:
+                    raise ValueError("length of data does not match")
+                value = data[pos : pos + length]
+                pos += length
+            elif wire_type == 5 or wire_type == 1:
+                length = 4 if wire_type == 5 else 8
+                if pos + length > end:
+                    raise ValueError("length of data does not match")
+                value = data[pos : pos + length]
+                pos += length
+            else:
+                raise AssertionError(wire_type)
+
+            if tag not in tags:
+                if unhandled is not None:
+                    unhandled[tag] = bytes(value) if isinstance(value, memoryview) else value
+                continue
+            name, conv, repeated, is_lazy, fixed, packed = tags[tag]
+            target = values
+            if wire_type == 0:
+                if conv is not None:
+                    value = conv(value)
+            elif wire_type == 2:
+                if lazy and is_lazy:
+                    target = pending
+                else:
+                    if isinstance(value, memoryview):
+                        value = bytes(value)
+                    if packed is not None:
+                        if name in values:
+                            values[name].extend(packed(value))
+                        else:
+                            values[name] = packed(value)
+                        continue
+                    if conv is not None:
+                        value = conv(value)
+            elif fixed is not None:
+                value = fixed(bytes(value))
+            else:  # 未声明类型的 fixed32 保持原有的大端解析
+                value = int.from_bytes(value, "big" if wire_type == 5 else "little")
+            if repeated:
+                if name in target:
+                    target[name].append(value)
+                else:
+                    target[name] = [value]
+            else:
+                target[name] = value
+
+        if unhandled:
+            _logger.debug(f"unhandled tags '{unhandled}' on {cls}")
+
+        inst = cls.__new__(cls)
+        attrs = inst.__dict__
+        undefined_params: list[str] = []
+        for name, default, default_factory in plan.fields:
+            if name in values:
+                attrs[name] = values[name]
+            elif name in pending:
+                continue
+            elif default is not MISSING:
+                attrs[name] = default
+            elif default_factory is not MISSING:
+                attrs[name] = default_factory()
+            else:
+                undefined_params.append(name)
+        if undefined_params:
+            raise AttributeError(
+                "Missing required parameters: "
+                + ", ".join(f"{n}({cls.__proto_fields__[n].tag})" for n in undefined_params)
+            )
+        if pending:
+            attrs["_proto_pending"] = pending
+        return inst
+
+    @classmethod
+    def _decode_validated(cls, data: bytes) -> Self:
+        pb_dict: Proto = proto_decode(data).proto
 
         kwargs = {
             field.name: pb_dict.pop(field.tag)
@@ -306,6 +638,12 @@ def evaluate_all():
     for cls in _unevaluated_classes:
         cls.update_forwardref(globalns)
     _unevaluated_classes.clear()
+
+    subclasses = ProtoStruct.__subclasses__()
+    while subclasses:
+        cls = subclasses.pop()
+        cls._compile_decoder()
+        subclasses.extend(cls.__subclasses__())
     modules.clear()
     globalns.clear()
     del modules
@@ -1,4 +1,5 @@
 import struct
+from functools import lru_cache
 from typing import Any, Union
 
 from typing_extensions import TypeAlias, Literal
@@ -6,12 +7,29 @@ from typing_extensions import TypeAlias, Literal
 LENGTH_PREFIX = Literal["u8", "u16", "u32", "u64"]
 BYTES_LIKE: TypeAlias = Union[bytes, bytearray, memoryview]
 
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+_TLV_HEAD = struct.Struct(">HH")
+_PREFIX = {"u8": (None, 1), "u16": (_U16, 2), "u32": (_U32, 4), "u64": (_U64, 8)}
+
+
+@lru_cache(maxsize=64)
+def _get_struct(format: str) -> struct.Struct:
+    return struct.Struct(format)
+
 
 class Reader:
-    def __init__(self, buffer: BYTES_LIKE):
+    """
+    所有定长整数都使用预编译的 struct.Struct 在当前偏移处 unpack_from, 不再先切片.
+    zero_copy=True 时内部持有 memoryview, read_bytes 等返回 memoryview 切片而非复制,
+    调用方需要在 buffer 生命周期内使用, 或自行 bytes() 保存
+    """
+
+    def __init__(self, buffer: BYTES_LIKE, zero_copy: bool = False):
         if not isinstance(buffer, (bytes, bytearray, memoryview)):
             raise TypeError("Invalid data: " + str(buffer))
-        self._buffer = buffer
+        self._buffer: BYTES_LIKE = memoryview(buffer) if zero_copy else buffer
         self._pos = 0
 
     @property
@@ -24,66 +42,59 @@ class Reader:
         return v
 
     def read_u16(self) -> int:
-        v = self._buffer[self._pos : self._pos + 2]
+        v = _U16.unpack_from(self._buffer, self._pos)[0]
         self._pos += 2
-        return struct.unpack(">H", v)[0]
+        return v
 
     def read_u32(self) -> int:
-        v = self._buffer[self._pos : self._pos + 4]
+        v = _U32.unpack_from(self._buffer, self._pos)[0]
         self._pos += 4
-        return struct.unpack(">I", v)[0]
+        return v
 
     def read_u64(self) -> int:
-        v = self._buffer[self._pos : self._pos + 8]
+        v = _U64.unpack_from(self._buffer, self._pos)[0]
         self._pos += 8
-        return struct.unpack(">Q", v)[0]
+        return v
 
     def read_struct(self, format: str) -> tuple[Any, ...]:
-        size = struct.calcsize(format)
-        v = self._buffer[self._pos : self._pos + size]
-        self._pos += size
-        return struct.unpack(format, v)
+        s = _get_struct(format)
+        v = s.unpack_from(self._buffer, self._pos)
+        self._pos += s.size
+        return v
 
     def read_bytes(self, length: int) -> bytes:
         v = self._buffer[self._pos : self._pos + length]
         self._pos += length
-        return v
+        return v  # type: ignore
+
+    def skip(self, length: int) -> None:
+        self._pos += length
 
     def read_string(self, length: int) -> str:
-        return self.read_bytes(length).decode("utf-8")
+        return str(self.read_bytes(length), "utf-8")
 
-    def read_bytes_with_length(self, prefix: LENGTH_PREFIX, with_prefix=True) -> bytes:
-        if with_prefix:
-            if prefix == "u8":
-                length = self.read_u8() - 1
-            elif prefix == "u16":
-                length = self.read_u16() - 2
-            elif prefix == "u32":
-                length = self.read_u32() - 4
-            else:
-                length = self.read_u64() - 8
+    def _read_length(self, prefix: LENGTH_PREFIX, with_prefix: bool) -> int:
+        s, size = _PREFIX[prefix]
+        if s is None:
+            length = self._buffer[self._pos]
         else:
-            if prefix == "u8":
-                length = self.read_u8()
-            elif prefix == "u16":
-                length = self.read_u16()
-            elif prefix == "u32":
-                length = self.read_u32()
-            else:
-                length = self.read_u64()
-        v = self._buffer[self._pos : self._pos + length]
-        self._pos += length
-        return v
+            length = s.unpack_from(self._buffer, self._pos)[0]
+        self._pos += size
+        return length - size if with_prefix else length
+
+    def read_bytes_with_length(self, prefix: LENGTH_PREFIX, with_prefix=True) -> bytes:
+        return self.read_bytes(self._read_length(prefix, with_prefix))
 
     def read_string_with_length(self, prefix: LENGTH_PREFIX, with_prefix=True) -> str:
-        return self.read_bytes_with_length(prefix, with_prefix).decode("utf-8")
+        return str(self.read_bytes_with_length(prefix, with_prefix), "utf-8")
 
     def read_tlv(self) -> dict[int, bytes]:
         result = {}
         count = self.read_u16()
 
         for i in range(count):
-            tag = self.read_u16()
-            result[tag] = self.read_bytes(self.read_u16())
+            tag, length = _TLV_HEAD.unpack_from(self._buffer, self._pos)
+            self._pos += 4
+            result[tag] = self.read_bytes(length)
 
         return result
@@ -1,114 +1,123 @@
-import struct
-from typing import Optional
-
-__all__ = ["qqtea_encrypt", "qqtea_decrypt"]
-
-
-def _xor(a, b):
-    op = 0xFFFFFFFF
-    a1, a2 = struct.unpack(b">LL", a[0:8])
-    b1, b2 = struct.unpack(b">LL", b[0:8])
-    return struct.pack(b">LL", (a1 ^ b1) & op, (a2 ^ b2) & op)
-
-
-def _tea_code(v, k) -> bytes:  # 传入8字节数据 16字节key
-    n = 16
-    op = 0xFFFFFFFF
-    delta = 0x9E3779B9
-    k = struct.unpack(b">LLLL", k[0:16])
-    v0, v1 = struct.unpack(b">LL", v[0:8])
-    sum_ = 0
-    for i in range(n):
-        sum_ += delta
-        v0 += (op & (v1 << 4)) + k[0] ^ v1 + sum_ ^ (op & (v1 >> 5)) + k[1]
-        v0 &= op
-        v1 += (op & (v0 << 4)) + k[2] ^ v0 + sum_ ^ (op & (v0 >> 5)) + k[3]
-        v1 &= op
-    r = struct.pack(b">LL", v0, v1)
-    return r
-
-
-def _tea_decipher(v: bytes, k: bytes) -> bytes:
-    n = 16
-    op = 0xFFFFFFFF
-    v0, v1 = struct.unpack(">LL", v[0:8])
-    k0, k1, k2, k3 = struct.unpack(b">LLLL", k[0:16])
-    delta = 0x9E3779B9
-    sum_ = (delta << 4) & op  # 左移4位 就是x16
-    for i in range(n):
-        v1 -= ((v0 << 4) + k2) ^ (v0 + sum_) ^ ((v0 >> 5) + k3)
-        v1 &= op
-        v0 -= ((v1 << 4) + k0) ^ (v1 + sum_) ^ ((v1 >> 5) + k1)
-        v0 &= op
-        sum_ -= delta
-        sum_ &= op
-    return struct.pack(b">LL", v0, v1)
+import sys
+from array import array
+from functools import lru_cache
+from typing import Optional, Union
+
+__all__ = ["qqtea_encrypt", "qqtea_decrypt", "qqtea_decrypt_many"]
+
+_OP = 0xFFFFFFFF
+_DELTA = 0x9E3779B9
+# 16 轮的 sum 值只与 delta 有关, 预先算好
+_SUMS = tuple((_DELTA * (i + 1)) & _OP for i in range(16))
+_RSUMS = _SUMS[::-1]
+_U32 = "I" if array("I").itemsize == 4 else "L"
+_SWAP = sys.byteorder == "little"
+
+
+def _to_words(data: Union[bytes, bytearray, memoryview]) -> array:
+    """一次性把整段数据解成大端 u32 数组"""
+    # 必须用 frombytes: array(_U32, memoryview) 会逐字节迭代而不是按 u32 解析
+    words = array(_U32)
+    words.frombytes(data)
+    if _SWAP:
+        words.byteswap()
+    return words
+
+
+def _from_words(words: array) -> bytes:
+    if _SWAP:
+        words.byteswap()
+    return words.tobytes()
 
 
 class _TEA:
     """
     QQ TEA 加解密, 64比特明码, 128比特密钥
-    这是一个确认线程安全的独立加密模块，使用时必须要有一个全局变量secret_key，要求大于等于16位
+    整段数据一次性解包为 u32 数组后在同一个循环内完成 TEA 与 CBC 链, 不再逐块 pack/unpack
     """
 
     def __init__(self, secret_key: bytes):
         self.secret_key = secret_key
+        self._key = tuple(_to_words(secret_key[:16]))
 
     @staticmethod
     def _preprocess(data: bytes) -> bytes:
-        data_len = len(data)
-        filln = (8 - (data_len + 2)) % 8 + 2
-        fills = bytearray()
-        for i in range(filln):
-            fills.append(220)
-        return bytes([(filln - 2) | 0xF8]) + fills + data + b"\x00" * 7
+        filln = (8 - (len(data) + 2)) % 8 + 2
+        return bytes(((filln - 2) | 0xF8,)) + b"\xdc" * filln + data + b"\x00" * 7
 
     def encrypt(self, data: bytes) -> bytes:
-        data = self._preprocess(data)
-        tr = b"\0" * 8
-        to = b"\0" * 8
-        result = bytearray()
-        for i in range(0, len(data), 8):
-            o = _xor(data[i : i + 8], tr)
-            tr = _xor(_tea_code(o, self.secret_key), to)
-            to = o
-            result += tr
-        return bytes(result)
-
-    def decrypt(self, text: bytes) -> Optional[bytes]:  # v不可变
-        data_len = len(text)
-        plain = _tea_decipher(text, self.secret_key)
-        pos = (plain[0] & 0x07) + 2
-        ret = plain
-        precrypt = text[0:8]
-        for i in range(8, data_len, 8):
-            x = _xor(
-                _tea_decipher(_xor(text[i : i + 8], plain), self.secret_key), precrypt
-            )  # 跳过了前8个字节
-            plain = _xor(x, precrypt)
-            precrypt = text[i : i + 8]
-            ret += x
-        if ret[-7:] != b"\0" * 7:
+        src = _to_words(self._preprocess(data))
+        out = array(_U32, bytes(len(src) * 4))
+        k0, k1, k2, k3 = self._key
+        tr0 = tr1 = to0 = to1 = 0
+        for i in range(0, len(src), 2):
+            o0 = v0 = src[i] ^ tr0
+            o1 = v1 = src[i + 1] ^ tr1
+            for s in _SUMS:
+                v0 = (v0 + (((v1 << 4) + k0) ^ (v1 + s) ^ ((v1 >> 5) + k1))) & _OP
+                v1 = (v1 + (((v0 << 4) + k2) ^ (v0 + s) ^ ((v0 >> 5) + k3))) & _OP
+            tr0 = out[i] = v0 ^ to0
+            tr1 = out[i + 1] = v1 ^ to1
+            to0, to1 = o0, o1
+        return _from_words(out)
+
+    def decrypt(self, text: bytes) -> Optional[bytes]:
+        if len(text) < 16 or len(text) % 8:
+            return None
+        src = _to_words(text)
+        out = array(_U32, bytes(len(src) * 4))
+        k0, k1, k2, k3 = self._key
+        pc0 = pc1 = p0 = p1 = 0
+        for i in range(0, len(src), 2):
+            c0, c1 = src[i], src[i + 1]
+            v0, v1 = c0 ^ p0, c1 ^ p1
+            for s in _RSUMS:
+                v1 = (v1 - (((v0 << 4) + k2) ^ (v0 + s) ^ ((v0 >> 5) + k3))) & _OP
+                v0 = (v0 - (((v1 << 4) + k0) ^ (v1 + s) ^ ((v1 >> 5) + k1))) & _OP
+            p0, p1 = v0, v1
+            out[i] = v0 ^ pc0
+            out[i + 1] = v1 ^ pc1
+            pc0, pc1 = c0, c1
+        plain = _from_words(out)
+        if plain[-7:] != b"\0" * 7:
             return None
-        return ret[pos + 1 : -7]
+        return plain[(plain[0] & 0x07) + 3 : -7]
+
+    def decrypt_many(self, texts: list[Union[bytes, bytearray, memoryview]]) -> list[Optional[bytes]]:
+        """同一 key 下的一批数据包, 共用已展开的密钥"""
+        return [self.decrypt(text) for text in texts]
+
+
+@lru_cache(maxsize=16)
+def _get_tea(key: bytes) -> _TEA:
+    return _TEA(key)
 
 
 def qqtea_encrypt(data: bytes, key: bytes) -> bytes:
-    return _TEA(key).encrypt(data)
+    return _get_tea(bytes(key)).encrypt(data)
 
 
 def qqtea_decrypt(data: bytes, key: bytes) -> bytes:
-    return _TEA(key).decrypt(data)
+    return _get_tea(bytes(key)).decrypt(data)  # type: ignore
+
+
+def qqtea_decrypt_many(data: list[bytes], key: bytes) -> list[bytes]:
+    """一次解密同一 key 下的多个数据包, 密钥只查找一次"""
+    return _get_tea(bytes(key)).decrypt_many(data)  # type: ignore
 
 
 try:
     from ftea import TEA as FTEA
 
     def qqtea_encrypt(data: bytes, key: bytes) -> bytes:
-        return FTEA(key).encrypt_qq(data)
+        return FTEA(bytes(key)).encrypt_qq(bytes(data))
 
     def qqtea_decrypt(data: bytes, key: bytes) -> bytes:
-        return FTEA(key).decrypt_qq(data)
+        return FTEA(bytes(key)).decrypt_qq(bytes(data))
+
+    def qqtea_decrypt_many(data: list[bytes], key: bytes) -> list[bytes]:
+        tea = FTEA(bytes(key))
+        return [tea.decrypt_qq(bytes(d)) for d in data]
 
 except ImportError:
     # Leave the pure Python version in place.
@@ -1,9 +1,14 @@
 import asyncio
 import gzip
 import json
+import os
+import socket
+import time
 import zlib
+from collections import deque
+from collections.abc import AsyncIterator, Iterable
 from dataclasses import dataclass
-from typing import Optional, overload, Literal
+from typing import IO, Callable, ClassVar, Optional, Union, overload, Literal
 from urllib import parse
 
 from .log import log
@@ -11,6 +16,63 @@ from .log import log
 _logger = log.fork("utils.httpcat")
 
 
+class HttpHeaders(dict[str, str]):
+    """
+    大小写不敏感的 http 头, 键统一为 Title-Case.
+    重复出现的头以 ", " 合并(Set-Cookie 只保留最后一个), get_all 返回全部原始值
+    """
+
+    def __init__(self, items: Iterable[tuple[str, str]] = ()):
+        super().__init__()
+        self._multi: dict[str, list[str]] = {}  # 只记录出现多次的头
+        for k, v in items:
+            self.add(k, v)
+
+    def add(self, key: str, value: str):
+        key = key.title()
+        if not super().__contains__(key):
+            super().__setitem__(key, value)
+            return
+        values = self._multi.get(key)
+        if values is None:
+            values = self._multi[key] = [super().__getitem__(key)]
+        values.append(value)
+        super().__setitem__(key, value if key == "Set-Cookie" else ", ".join(values))
+
+    def get_all(self, key: str) -> list[str]:
+        key = key.title()
+        if key in self._multi:
+            return list(self._multi[key])
+        return [super().__getitem__(key)] if super().__contains__(key) else []
+
+    def __getitem__(self, key: str) -> str:
+        return super().__getitem__(key.title())
+
+    def __setitem__(self, key: str, value: str):
+        key = key.title()
+        self._multi.pop(key, None)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: str):
+        key = key.title()
+        self._multi.pop(key, None)
+        super().__delitem__(key)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and super().__contains__(key.title())
+
+    def get(self, key: str, default=None):  # type: ignore
+        return super().get(key.title(), default)
+
+    def pop(self, key: str, *default):  # type: ignore
+        key = key.title()
+        self._multi.pop(key, None)
+        return super().pop(key, *default)
+
+    def __reduce__(self):
+        return self.__class__, ([(k, v) for k in self for v in self.get_all(k)],)
+
+
 @dataclass
 class HttpResponse:
     code: int
@@ -46,6 +108,134 @@ class HttpResponse:
         return self.decompressed_body.decode(encoding, errors)
 
 
+def _decompressor(encoding: Optional[str]):
+    if not encoding or encoding == "identity":
+        return None
+    elif encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        return zlib.decompressobj()
+    raise TypeError("Unsuppoted compress type:", encoding)
+
+
+class HttpStreamResponse:
+    """
+    body 未读取的响应, 通过 iter_chunks / download_to 以固定内存读取.
+    body 读完或 close 后释放连接, 未读完就 close 的连接不会被复用
+    """
+
+    def __init__(
+        self,
+        code: int,
+        status: str,
+        header: dict[str, str],
+        cookies: dict[str, str],
+        reader: asyncio.StreamReader,
+        release: Callable[[bool], None],
+        no_body=False,
+    ):
+        self.code = code
+        self.status = status
+        self.header = header
+        self.cookies = cookies
+        self.received = 0  # 已收到的 body 字节数(解压前)
+        self._reader = reader
+        self._release: Optional[Callable[[bool], None]] = release
+        self._consumed = False
+        if no_body:
+            self._finish(True)
+
+    @property
+    def content_length(self) -> Optional[int]:
+        if "Content-Length" in self.header:
+            return int(self.header["Content-Length"])
+        return None
+
+    def _finish(self, complete: bool):
+        self._consumed = True
+        if self._release:
+            release, self._release = self._release, None
+            release(complete)
+
+    async def iter_raw(self, chunk_size=65536) -> AsyncIterator[bytes]:
+        """未解压的 body, 每块不超过 chunk_size"""
+        if self._consumed:
+            return
+        self._consumed = True
+        try:
+            async for chunk in HttpCat._iter_body(self.header, self._reader, chunk_size):
+                self.received += len(chunk)
+                yield chunk
+        except BaseException:
+            self._finish(False)
+            raise
+        self._finish(True)
+
+    async def iter_chunks(self, chunk_size=65536, decompress=True) -> AsyncIterator[bytes]:
+        """按 Content-Encoding 增量解压后的 body"""
+        dec = _decompressor(self.header.get("Content-Encoding")) if decompress else None
+        async for chunk in self.iter_raw(chunk_size):
+            if dec:
+                chunk = dec.decompress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if dec:
+            tail = dec.flush()
+            if tail:
+                yield tail
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self.iter_chunks()
+
+    async def read(self, decompress=True) -> bytes:
+        """一次读取整个 body"""
+        if self._consumed:
+            return b""
+        self._consumed = True
+        try:
+            data = await HttpCat._read_all(self.header, self._reader)
+        except BaseException:
+            self._finish(False)
+            raise
+        self.received = len(data)
+        self._finish(True)
+        dec = _decompressor(self.header.get("Content-Encoding")) if decompress else None
+        return dec.decompress(data) + dec.flush() if dec else data
+
+    async def download_to(
+        self,
+        target: Union[str, os.PathLike[str], IO[bytes]],
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+        chunk_size=65536,
+    ) -> int:
+        """
+        写入文件路径或可写的文件对象, 返回写入的字节数(解压后).
+        progress(received, total) 在每块写入后调用, 两者均为解压前的字节数, total 未知时为 None
+        """
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, "wb") as f:
+                return await self.download_to(f, progress, chunk_size)
+        written = 0
+        total = self.content_length
+        async for chunk in self.iter_chunks(chunk_size):
+            target.write(chunk)
+            written += len(chunk)
+            if progress:
+                progress(self.received, total)
+        return written
+
+    def close(self):
+        if not self._consumed or self._release:
+            self._finish(False)
+
+    async def __aenter__(self) -> "HttpStreamResponse":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class HttpCat:
     def __init__(
         self,
@@ -102,49 +292,115 @@ class HttpCat:
         )
 
     @classmethod
-    async def _read_all(cls, header: dict, reader: asyncio.StreamReader) -> bytes:
-        if header.get("Transfer-Encoding") == "chunked":
-            bs = bytearray()
+    async def _iter_body(
+        cls, header: dict, reader: asyncio.StreamReader, chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """逐块读取 body, chunk_size 为 None 时不拆分"""
+        if "chunked" in header.get("Transfer-Encoding", "").lower():
             while True:
                 len_hex = await cls._read_line(reader)
-                if len_hex:
-                    length = int(len_hex, 16)
-                    if length:
-                        bs += await reader.readexactly(length)
-                    else:
-                        break
-                else:
+                if not len_hex:
                     if header.get("Connection") == "close":  # cloudflare?
-                        break
+                        return
                     raise ConnectionResetError("Connection reset by peer")
-            return bytes(bs)
+                length = int(len_hex.split(";", 1)[0], 16)
+                if not length:
+                    while True:  # trailer, 合并到响应头中
+                        line = await cls._read_line(reader)
+                        if not line:
+                            return
+                        k, sep, v = line.partition(":")
+                        if sep and isinstance(header, HttpHeaders):
+                            header.add(k.strip(), v.strip())
+                while length:
+                    n = min(length, chunk_size) if chunk_size else length
+                    yield await reader.readexactly(n)
+                    length -= n
+                await reader.readexactly(2)  # CRLF
         elif "Content-Length" in header:
-            return await reader.readexactly(int(header["Content-Length"]))
+            remain = int(header["Content-Length"])
+            while remain:
+                n = min(remain, chunk_size) if chunk_size else remain
+                yield await reader.readexactly(n)
+                remain -= n
         else:
-            return await reader.read()
+            while True:
+                data = await reader.read(chunk_size or -1)
+                if not data:
+                    return
+                yield data
 
     @classmethod
-    async def _parse_response(cls, reader: asyncio.StreamReader) -> HttpResponse:
-        stat = await cls._read_line(reader)
-        if not stat:
-            raise ConnectionResetError
-        _, code, status = stat.split(" ", 2)
-        header = {}
+    async def _read_all(cls, header: dict, reader: asyncio.StreamReader) -> bytes:
+        if "Content-Length" in header and "Transfer-Encoding" not in header:
+            return await reader.readexactly(int(header["Content-Length"]))
+        return b"".join([chunk async for chunk in cls._iter_body(header, reader)])
+
+    @classmethod
+    async def _parse_head(cls, reader: asyncio.StreamReader) -> tuple[int, str, HttpHeaders, dict[str, str]]:
+        # 一次读取整个响应头
+        try:
+            block = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                raise ConnectionResetError("Connection reset by peer") from None
+            raise
+        stat, *lines = block[:-4].decode().split("\r\n")
+        _, code, *status = stat.split(" ", 2)
+        header = HttpHeaders()
         cookies = {}
-        while True:
-            head_block = await cls._read_line(reader)
-            if head_block:
-                k, v = head_block.split(": ")
-                if k.title() == "Set-Cookie":
-                    name, value = v[: v.find(";")].split("=", 1)
-                    cookies[name] = value
-                else:
-                    header[k.title()] = v
-            else:
-                break
-        return HttpResponse(
-            int(code), status, header, await cls._read_all(header, reader), cookies
-        )
+        for line in lines:
+            k, sep, v = line.partition(":")
+            if not sep:
+                continue
+            k, v = k.strip(), v.strip()
+            header.add(k, v)
+            if k.lower() == "set-cookie":
+                name, sep, value = v.split(";", 1)[0].partition("=")
+                if sep:
+                    cookies[name.strip()] = value.strip()
+        return int(code), status[0] if status else "", header, cookies
+
+    @staticmethod
+    def _has_body(method: str, code: int) -> bool:
+        return method.upper() != "HEAD" and code not in (204, 304) and code >= 200
+
+    @classmethod
+    async def _parse_response(cls, reader: asyncio.StreamReader, head_only=False) -> HttpResponse:
+        code, status, header, cookies = await cls._parse_head(reader)
+        if head_only or not cls._has_body("GET", code):
+            body = b""
+        else:
+            body = await cls._read_all(header, reader)
+        return HttpResponse(code, status, header, body, cookies)
+
+    @classmethod
+    async def _write_request(
+        cls,
+        host: str,
+        writer: asyncio.StreamWriter,
+        method: str,
+        path: str,
+        header: Optional[dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        cookies: Optional[dict[str, str]] = None,
+    ) -> dict[str, str]:
+        header = {
+            "Host": host,
+            "Connection": "close",
+            "User-Agent": "HttpCat/1.1",
+            "Accept-Encoding": "gzip, deflate",
+            "Content-Length": "0" if not body else str(len(body)),
+            **(header if header else {}),
+        }
+        if cookies:
+            header["Cookie"] = "; ".join([f"{k}={v}" for k, v in cookies.items()])
+
+        writer.write(cls._encode_header(method, path, header))
+        if body:
+            writer.write(body)
+        await writer.drain()
+        return header
 
     @classmethod
     @overload
@@ -196,25 +452,11 @@ class HttpCat:
     ) -> Optional[HttpResponse]:
         if not loop:
             loop = asyncio.get_running_loop()
-        header = {
-            "Host": host,
-            "Connection": "close",
-            "User-Agent": "HttpCat/1.1",
-            "Accept-Encoding": "gzip, deflate",
-            "Content-Length": "0" if not body else str(len(body)),
-            **(header if header else {}),
-        }
-        if cookies:
-            header["Cookie"] = "; ".join([f"{k}={v}" for k, v in cookies.items()])
-
-        writer.write(cls._encode_header(method, path, header))
-        if body:
-            writer.write(body)
-        await writer.drain()
+        header = await cls._write_request(host, writer, method, path, header, body, cookies)
 
         if wait_rsp:
             try:
-                return await cls._parse_response(reader)
+                return await cls._parse_response(reader, method.upper() == "HEAD")
             finally:
                 if header["Connection"] == "close":
                     loop.call_soon(writer.close)
@@ -249,6 +491,43 @@ class HttpCat:
         else:
             return resp
 
+    @classmethod
+    async def stream(
+        cls,
+        method: str,
+        url: str,
+        header: Optional[dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        cookies: Optional[dict[str, str]] = None,
+        follow_redirect=True,
+        conn_timeout=0,
+    ) -> HttpStreamResponse:
+        """与 request 相同, 但不读取 body; 连接在 body 读完或 close 后关闭"""
+        address, path, ssl = cls._parse_url(url)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(*address, ssl=ssl), conn_timeout or None
+        )
+        try:
+            await cls._write_request(address[0], writer, method, path, header, body, cookies)
+            code, status, rsp_header, rsp_cookies = await cls._parse_head(reader)
+        except BaseException:
+            writer.close()
+            raise
+        resp = HttpStreamResponse(
+            code,
+            status,
+            rsp_header,
+            rsp_cookies,
+            reader,
+            lambda _: writer.close(),
+            not cls._has_body(method, code),
+        )
+        _logger.debug(f"stream({method})[{code}]: {url}")
+        if code // 100 == 3 and follow_redirect:
+            resp.close()
+            return await cls.stream(method, parse.urljoin(url, rsp_header["Location"]), header, body, cookies)
+        return resp
+
     async def send_request(
         self, method: str, path: str, body=None, follow_redirect=True, conn_timeout=0
     ) -> HttpResponse:
@@ -299,3 +578,261 @@ class HttpCat:
             self._writer.close()
             await self._writer.wait_closed()
             self._reader, self._writer = None, None
+
+
+_Conn = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"})
+
+
+@dataclass
+class HostPoolStats:
+    opened: int = 0
+    reused: int = 0
+    retries: int = 0  # 复用的连接失效后重试的次数
+    idle: int = 0
+
+
+class _HostPool:
+    def __init__(self, limit: int):
+        self.idle: deque[tuple[_Conn, float]] = deque()
+        self.sem = asyncio.Semaphore(limit)
+        self.stats = HostPoolStats()
+
+
+class HttpCatPool:
+    """
+    按 (host, port, ssl) 复用 keep-alive 连接的连接池.
+    每个 host 最多 max_per_host 个并发连接, 空闲超过 idle_timeout 的连接会被关闭;
+    复用的连接已被服务端关闭时, 幂等请求会自动在新连接上重试一次.
+    HttpCatPool.default() 返回进程内共享的实例
+    """
+
+    _default: ClassVar[Optional["HttpCatPool"]] = None
+
+    def __init__(
+        self,
+        max_per_host: int = 8,
+        idle_timeout: float = 30.0,
+        conn_timeout: float = 10.0,
+        *,
+        reap_interval: float = 15.0,
+        headers: Optional[dict[str, str]] = None,
+    ):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.conn_timeout = conn_timeout
+        self.reap_interval = reap_interval
+        self.header: dict[str, str] = headers or {}
+        self._hosts: dict[tuple[str, int, bool], _HostPool] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    @classmethod
+    def default(cls) -> "HttpCatPool":
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def stats(self) -> dict[str, HostPoolStats]:
+        ret = {}
+        for (host, port, ssl), hp in self._hosts.items():
+            hp.stats.idle = len(hp.idle)
+            ret[f"http{'s' if ssl else ''}://{host}:{port}"] = hp.stats
+        return ret
+
+    def _get_host(self, key: tuple[str, int, bool]) -> _HostPool:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:  # 连接与 Semaphore 都属于创建时的事件循环
+            self._drop_loop()
+            self._loop = loop
+        if not self._reaper or self._reaper.done():
+            self._reaper = loop.create_task(self._reap_loop(), name="httpcat_pool_reaper")
+        if key not in self._hosts:
+            self._hosts[key] = _HostPool(self.max_per_host)
+        return self._hosts[key]
+
+    def _drop_loop(self):
+        """事件循环更换(例如多次 asyncio.run)时关闭旧循环上的空闲连接并停止旧的 reaper"""
+        old = self._loop
+        call = old.call_soon_threadsafe if old and old.is_running() else lambda f: f()
+        if self._reaper and not self._reaper.done() and old and not old.is_closed():
+            call(self._reaper.cancel)
+        self._reaper = None
+        for hp in self._hosts.values():
+            while hp.idle:
+                call(lambda conn=hp.idle.pop()[0]: self._abort(conn))
+        self._hosts.clear()
+
+    @staticmethod
+    def _abort(conn: _Conn):
+        transport = conn[1].transport
+        try:
+            transport.abort()
+        except RuntimeError:  # 所属事件循环已关闭, 直接断开 socket, fd 随 transport 回收
+            sock = transport.get_extra_info("socket")
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _usable(conn: _Conn) -> bool:
+        reader, writer = conn
+        return not (writer.is_closing() or reader.at_eof() or reader.exception())
+
+    def _checkout(self, hp: _HostPool) -> Optional[_Conn]:
+        now = time.monotonic()
+        while hp.idle:
+            conn, last_used = hp.idle.pop()  # 优先使用最近用过的连接
+            if now - last_used < self.idle_timeout and self._usable(conn):
+                return conn
+            conn[1].close()
+        return None
+
+    def _checkin(self, hp: _HostPool, conn: _Conn, req_header: dict[str, str], rsp_header: dict[str, str]):
+        if (
+            req_header.get("Connection", "").lower() != "close"
+            and rsp_header.get("Connection", "").lower() != "close"
+            and self._usable(conn)
+        ):
+            hp.idle.append((conn, time.monotonic()))
+        else:
+            conn[1].close()
+
+    def _reap(self):
+        now = time.monotonic()
+        for hp in self._hosts.values():
+            keep: deque[tuple[_Conn, float]] = deque()
+            for conn, last_used in hp.idle:
+                if now - last_used < self.idle_timeout and self._usable(conn):
+                    keep.append((conn, last_used))
+                else:
+                    conn[1].close()
+            hp.idle = keep
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            self._reap()
+
+    async def _open(self, hp: _HostPool, key: tuple[str, int, bool]) -> _Conn:
+        host, port, ssl = key
+        conn = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=ssl), self.conn_timeout)
+        hp.stats.opened += 1
+        _logger.debug(f"pool connected to {host}:{port}")
+        return conn
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        header: Optional[dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        cookies: Optional[dict[str, str]] = None,
+        follow_redirect=True,
+        *,
+        idempotent: Optional[bool] = None,
+        timeout: Optional[float] = None,
+    ) -> HttpResponse:
+        """
+        idempotent 为 None 时按 method 判断, 非幂等请求在复用连接失效时不会重试;
+        timeout 为单次请求(不含建立连接)的超时时间
+        """
+
+        async def fetch() -> HttpResponse:
+            resp = await self.stream(method, url, header, body, cookies, follow_redirect, idempotent=idempotent)
+            try:
+                data = await resp.read(decompress=False)
+            finally:
+                resp.close()
+            return HttpResponse(resp.code, resp.status, resp.header, data, resp.cookies)
+
+        if timeout is None:
+            return await fetch()
+        return await asyncio.wait_for(fetch(), timeout)
+
+    async def stream(
+        self,
+        method: str,
+        url: str,
+        header: Optional[dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        cookies: Optional[dict[str, str]] = None,
+        follow_redirect=True,
+        *,
+        idempotent: Optional[bool] = None,
+    ) -> HttpStreamResponse:
+        """
+        只读取响应头, body 通过返回值以流的方式读取.
+        在 body 读完或 close 之前会一直占用该 host 的一个连接名额
+        """
+        (host, port), path, ssl = HttpCat._parse_url(url)
+        key = (host, port, ssl)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        host_header = host if port == (443 if ssl else 80) else f"{host}:{port}"
+        header = {"Connection": "keep-alive", **self.header, **(header or {})}
+        hp = self._get_host(key)
+
+        async def exchange(conn: _Conn):
+            try:
+                await HttpCat._write_request(host_header, conn[1], method, path, header, body, cookies)
+                return await HttpCat._parse_head(conn[0])
+            except BaseException:
+                conn[1].close()
+                raise
+
+        await hp.sem.acquire()
+        try:
+            head = None
+            conn = self._checkout(hp)
+            if conn:
+                hp.stats.reused += 1
+                try:
+                    head = await exchange(conn)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # 服务端可能已关闭空闲连接
+                    if not idempotent:
+                        raise
+                    hp.stats.retries += 1
+            if head is None:
+                conn = await self._open(hp, key)
+                head = await exchange(conn)
+        except BaseException:
+            hp.sem.release()
+            raise
+        code, status, rsp_header, rsp_cookies = head
+
+        def release(complete: bool):
+            if complete:
+                self._checkin(hp, conn, header, rsp_header)  # type: ignore
+            else:
+                conn[1].close()  # type: ignore
+            hp.sem.release()
+
+        resp = HttpStreamResponse(
+            code, status, rsp_header, rsp_cookies, conn[0], release, not HttpCat._has_body(method, code)
+        )
+        _logger.debug(f"pooled request({method})[{code}]: {url}")
+        if code // 100 == 3 and follow_redirect:
+            async with resp:
+                await resp.read(decompress=False)
+            return await self.stream(
+                method,
+                parse.urljoin(url, rsp_header["Location"]),
+                header,
+                body,
+                cookies,
+                idempotent=idempotent,
+            )
+        return resp
+
+    def close(self):
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        for hp in self._hosts.values():
+            while hp.idle:
+                hp.idle.pop()[0][1].close()
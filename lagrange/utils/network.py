@@ -1,12 +1,153 @@
 import asyncio
 import traceback
-from typing import Optional
+from collections import deque
+from typing import Any, Optional, Union
 
 from .log import log
 
 _logger = log.fork("network")
 
 
+class FrameProtocol(asyncio.BufferedProtocol):
+    """
+    按 u32 长度前缀 (包含自身) 分帧的 BufferedProtocol.
+    数据直接读入可复用的缓冲区, 每次 buffer_updated 切出所有完整的帧 (memoryview, 不含长度前缀);
+    有未处理的帧时暂停读取, 消费者处理完后调用 release() 回收空间并恢复读取
+    """
+
+    def __init__(self, buffer_size: int = 256 * 1024):
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # 第一个未完成帧的起点
+        self._end = 0  # 已写入数据的终点
+        self._frames: list[memoryview] = []
+        self._ready = asyncio.Event()
+        self._closed = asyncio.get_running_loop().create_future()
+        self._exc: Optional[BaseException] = None
+        self._transport: Optional[asyncio.Transport] = None
+        self._paused = False
+        self._drain_waiters: deque[asyncio.Future] = deque()
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        self._exc = exc or ConnectionResetError("Connection lost")
+        self._ready.set()
+        if not self._closed.done():
+            self._closed.set_result(None)
+        self._wake_drain_waiters()
+
+    def eof_received(self):
+        return False
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake_drain_waiters()
+
+    def _wake_drain_waiters(self):
+        while self._drain_waiters:
+            fut = self._drain_waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self._view[self._end :]
+
+    def buffer_updated(self, nbytes: int):
+        self._end += nbytes
+        buf, pos, end = self._buf, self._start, self._end
+        while end - pos >= 4:
+            length = int.from_bytes(buf[pos : pos + 4], "big")
+            if length < 4 or end - pos < length:
+                if length < 4:  # 空帧, 与 stream 模式一致交给消费者关闭连接
+                    self._frames.append(self._view[pos:pos])
+                    pos = end
+                break
+            self._frames.append(self._view[pos + 4 : pos + length])
+            pos += length
+        self._start = pos
+        if self._frames:
+            self._transport.pause_reading()  # type: ignore
+            self._ready.set()
+        else:
+            self._reserve()
+
+    def _reserve(self):
+        """把未完成的帧移动到缓冲区开头, 并保证能容纳整个帧"""
+        pending = self._end - self._start
+        if not pending:
+            self._start = self._end = 0
+            return
+        need = 4
+        if pending >= 4:
+            need = max(int.from_bytes(self._buf[self._start : self._start + 4], "big"), pending)
+        if self._start + need <= len(self._buf) and len(self._buf) - self._end >= 4096:
+            return
+        if need + 4096 > len(self._buf):  # 单个帧比缓冲区大
+            buf = bytearray(max(need + 4096, len(self._buf) * 2))
+            buf[:pending] = self._view[self._start : self._end]
+            self._buf, self._view = buf, memoryview(buf)
+        else:
+            self._view[:pending] = bytes(self._view[self._start : self._end])
+        self._start, self._end = 0, pending
+
+    async def get_frames(self) -> list[memoryview]:
+        await self._ready.wait()
+        if not self._frames and self._exc:
+            raise self._exc
+        return self._frames
+
+    def release(self):
+        """消费者已处理完 get_frames 返回的帧, 之后这些 memoryview 的内容会被覆盖"""
+        self._frames = []
+        self._ready.clear()
+        if self._exc:
+            self._ready.set()
+            return
+        self._reserve()
+        self._transport.resume_reading()  # type: ignore
+
+
+class ProtocolWriter:
+    """FrameProtocol 的写端, 提供 Connection 用到的 StreamWriter 接口"""
+
+    def __init__(self, transport: asyncio.Transport, protocol: FrameProtocol):
+        self._transport = transport
+        self._protocol = protocol
+
+    def write(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        self._transport.write(data)
+
+    def writelines(self, data) -> None:
+        self._transport.writelines(data)
+
+    async def drain(self) -> None:
+        if self._protocol._exc:
+            raise self._protocol._exc
+        if self._protocol._paused:
+            fut = asyncio.get_running_loop().create_future()
+            self._protocol._drain_waiters.append(fut)
+            await fut
+            if self._protocol._exc:
+                raise self._protocol._exc
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return self._transport.get_extra_info(name, default)
+
+    def is_closing(self) -> bool:
+        return self._transport.is_closing()
+
+    def close(self) -> None:
+        self._transport.close()
+
+    async def wait_closed(self) -> None:
+        await asyncio.shield(self._protocol._closed)
+
+
 class Connection:
     def __init__(
         self,
@@ -14,6 +155,8 @@ class Connection:
         port: int,
         ssl: bool = False,
         timeout: Optional[float] = 10,
+        *,
+        buffered: bool = False,
     ) -> None:
         self._host = host
         self._port = port
@@ -21,9 +164,12 @@ class Connection:
         self._stop_flag = False
         self._stop_ev = asyncio.Event()
         self.timeout = timeout
+        # 使用 FrameProtocol 收包, 由 on_frame 处理; 否则使用 StreamReader 与 on_message
+        self.buffered = buffered
 
         self._reader: Optional[asyncio.StreamReader] = None
-        self._writer: Optional[asyncio.StreamWriter] = None
+        self._writer: Optional[Union[asyncio.StreamWriter, ProtocolWriter]] = None
+        self._protocol: Optional[FrameProtocol] = None
 
     @property
     def host(self) -> str:
@@ -38,7 +184,7 @@ class Connection:
         return self._ssl
 
     @property
-    def writer(self) -> asyncio.StreamWriter:
+    def writer(self) -> Union[asyncio.StreamWriter, ProtocolWriter]:
         if not self._writer:
             raise RuntimeError("Connection closed!")
         return self._writer
@@ -59,6 +205,13 @@ class Connection:
     async def connect(self) -> None:
         if self._stop_flag:
             raise RuntimeError("Connection already stopped")
+        if self.buffered:
+            transport, self._protocol = await asyncio.wait_for(
+                asyncio.get_running_loop().create_connection(FrameProtocol, self.host, self.port, ssl=self.ssl),
+                self.timeout,
+            )
+            self._writer = ProtocolWriter(transport, self._protocol)  # type: ignore
+            return
         self._reader, self._writer = await asyncio.wait_for(
             asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout
         )
@@ -72,6 +225,7 @@ class Connection:
         await self.writer.wait_closed()
         self._reader = None
         self._writer = None
+        self._protocol = None
 
     async def stop(self):
         if self._stop_flag:
@@ -80,8 +234,23 @@ class Connection:
         await self.close(force=True)
         self._stop_ev.set()
 
+    async def _read_frames(self):
+        protocol = self._protocol
+        while not self.closed:
+            frames = await protocol.get_frames()  # type: ignore
+            try:
+                for frame in frames:
+                    if frame:
+                        await self.on_frame(frame)
+                    else:
+                        return await self.close()
+            finally:
+                protocol.release()  # type: ignore
+
     async def _read_loop(self):
         try:
+            if self.buffered:
+                return await self._read_frames()
             while not self.closed:
                 length = (
                     int.from_bytes(await self.reader.readexactly(4), byteorder="big")
@@ -120,6 +289,9 @@ class Connection:
 
     async def on_message(self, message_length: int): ...
 
+    async def on_frame(self, frame: memoryview):
+        """buffered 模式下的收包回调, frame 仅在回调返回前有效"""
+
     async def on_error(self) -> bool:
         """use sys.exc_info() to catch exceptions"""
         traceback.print_exc()
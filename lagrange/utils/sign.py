@@ -1,7 +1,15 @@
-import time
+import asyncio
+import bisect
+import hashlib
 import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Iterable, Sequence
+from concurrent.futures import Executor
+from typing import Callable, Optional, Union
 
-from .httpcat import HttpCat
+from .httpcat import HostPoolStats, HttpCat, HttpCatPool, HttpResponse
 from .log import log
 
 _logger = log.fork("sign_provider")
@@ -46,26 +54,117 @@ SIGN_PKG_LIST = [
 ]
 
 
-def sign_provider(upstream_url: str):
-    async def get_sign(cmd: str, seq: int, buf: bytes) -> dict:
-        if cmd not in SIGN_PKG_LIST:
-            return {}
+class LatencyHistogram:
+    """按固定桶统计耗时, 单位 ms"""
+
+    BOUNDS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float):
+        self.buckets[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """返回第 q 百分位所在桶的上界, 最后一个桶返回 max"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        acc = 0
+        for i, n in enumerate(self.buckets):
+            acc += n
+            if acc >= rank:
+                return float(self.BOUNDS[i]) if i < len(self.BOUNDS) else self.max
+        return self.max
 
-        params = {"cmd": cmd, "seq": seq, "src": buf.hex()}
-        body = json.dumps(params).encode("utf-8")
-        headers = {
-            "Content-Type": "application/json"
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
         }
+
+
+class SignPool:
+    """
+    到签名服务的 keep-alive 连接池, 同一进程中的所有账号共用.
+    连接由独立的 HttpCatPool 管理, 签名请求视为幂等, 复用的连接失效时换新连接重试一次
+    """
+
+    def __init__(
+        self,
+        upstream_url: str,
+        max_size: int = 8,
+        *,
+        idle_timeout: float = 30.0,
+        request_timeout: float = 10.0,
+        health_interval: float = 15.0,
+    ):
+        (host, port), self.path, ssl = HttpCat._parse_url(upstream_url)
+        self.base_url = f"http{'s' if ssl else ''}://{host}:{port}"
+        self.url = upstream_url
+        self.request_timeout = request_timeout
+        self.http = HttpCatPool(
+            max_size,
+            idle_timeout,
+            request_timeout,
+            reap_interval=health_interval,
+            headers={"Content-Type": "application/json"},
+        )
+        self.latency = LatencyHistogram()
+        self.cmd_latency: dict[str, LatencyHistogram] = {}
+        self.failures = 0
+        self.consecutive_failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.consecutive_failures < 3
+
+    def stats(self) -> dict:
+        conn = self.http.stats().get(self.base_url, HostPoolStats())
+        return {
+            "idle": conn.idle,
+            "opened": conn.opened,
+            "reused": conn.reused,
+            "retries": conn.retries,
+            "failures": self.failures,
+            "healthy": self.healthy,
+            "latency": self.latency.summary(),
+            "cmd_latency": {k: v.summary() for k, v in self.cmd_latency.items()},
+        }
+
+    async def post(self, body: bytes, path: Optional[str] = None) -> HttpResponse:
+        return await self.http.request(
+            "POST", self.base_url + (path or self.path), body=body, idempotent=True, timeout=self.request_timeout
+        )
+
+    async def _post_json(self, payload, tag: str, path: Optional[str] = None):
+        body = json.dumps(payload).encode("utf-8")
         for _ in range(3):
             try:
-                start_time = time.time()
-                ret = await HttpCat.request("POST", upstream_url, body=body, header=headers)
+                start_time = time.perf_counter()
+                ret = await self.post(body, path)
                 if ret.code != 200:
                     raise ConnectionAbortedError(ret.code, ret.body)
-                _logger.debug(
-                    f"signed for [{cmd}:{seq}]({(time.time() - start_time) * 1000:.2f}ms)"
-                )
-            except Exception:
+                cost = (time.perf_counter() - start_time) * 1000
+                self.latency.add(cost)
+                self.cmd_latency.setdefault(tag.split(":")[0], LatencyHistogram()).add(cost)
+                self.consecutive_failures = 0
+                _logger.debug(f"signed for [{tag}]({cost:.2f}ms)")
+            except Exception as e:
+                if isinstance(e, ConnectionAbortedError) and e.args[0] in (404, 405):  # 重试也不会成功
+                    raise
+                self.failures += 1
+                self.consecutive_failures += 1
                 _logger.exception("Unexpected error on sign request:")
                 continue
             break
@@ -74,4 +173,269 @@ def sign_provider(upstream_url: str):
 
         return ret.json()["value"]
 
-    return get_sign
+    async def sign(self, cmd: str, seq: int, buf: bytes) -> dict:
+        return await self._post_json({"cmd": cmd, "seq": seq, "src": buf.hex()}, f"{cmd}:{seq}")
+
+    async def sign_batch(self, items: Sequence[tuple[str, int, bytes]], path: str) -> list[dict]:
+        """一次请求签名多个包, 请求体为 json 数组, 返回值按相同顺序排列"""
+        payload = [{"cmd": cmd, "seq": seq, "src": buf.hex()} for cmd, seq, buf in items]
+        ret = await self._post_json(payload, f"batch:{len(items)}", path)
+        if len(ret) != len(items):
+            raise ValueError(f"batch sign returned {len(ret)} results for {len(items)} packets")
+        return ret
+
+    def close(self):
+        self.http.close()
+
+
+_pools: dict[str, SignPool] = {}
+
+
+def get_sign_pool(upstream_url: str, **kwargs) -> SignPool:
+    """同一签名地址在进程内只创建一个连接池, kwargs 仅在首次创建时生效"""
+    if upstream_url not in _pools:
+        _pools[upstream_url] = SignPool(upstream_url, **kwargs)
+    return _pools[upstream_url]
+
+
+class Signer(ABC):
+    """
+    签名器基类, 实例可以直接作为 Client 的 sign_provider 使用.
+    只有 SIGN_PKG_LIST 中的命令会交给 sign 处理
+    """
+
+    @abstractmethod
+    async def sign(self, cmd: str, seq: int, buf: bytes) -> dict:
+        """返回 {"sign": ..., "token": ..., "extra": ...}"""
+
+    async def sign_batch(self, items: Sequence[tuple[str, int, bytes]]) -> list[dict]:
+        return list(await asyncio.gather(*[self.sign(*i) for i in items]))
+
+    async def __call__(self, cmd: str, seq: int, buf: bytes) -> dict:
+        if cmd not in SIGN_PKG_LIST:
+            return {}
+        return await self.sign(cmd, seq, buf)
+
+
+class HttpSigner(Signer):
+    """
+    通过 http 签名服务签名.
+    设置 batch_path 后, 有批量请求未返回时, batch_delay 时间内到达的请求会合并为一次请求发往 batch_path;
+    没有请求在途时在本轮事件循环结束后立即发送. 服务端不支持(404/405)时自动退回逐个签名
+    """
+
+    def __init__(
+        self,
+        upstream_url: str,
+        *,
+        batch_path: Optional[str] = None,
+        max_batch: int = 16,
+        batch_delay: float = 0.002,
+        **pool_options,
+    ):
+        self.pool = get_sign_pool(upstream_url, **pool_options)
+        self.batch_path = batch_path
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self._batch: list[tuple[str, int, bytes, asyncio.Future[dict]]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._inflight = 0
+
+    async def sign(self, cmd: str, seq: int, buf: bytes) -> dict:
+        if not self.batch_path:
+            return await self.pool.sign(cmd, seq, buf)
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future[dict] = loop.create_future()
+        self._batch.append((cmd, seq, buf, fut))
+        if len(self._batch) >= self.max_batch:
+            self._flush()
+        elif not self._flush_handle:
+            self._flush_handle = loop.call_later(self.batch_delay if self._inflight else 0, self._flush)
+        return await fut
+
+    async def sign_batch(self, items: Sequence[tuple[str, int, bytes]]) -> list[dict]:
+        if self.batch_path and len(items) > 1:
+            try:
+                return await self.pool.sign_batch(items, self.batch_path)
+            except ConnectionAbortedError as e:
+                if e.args[0] not in (404, 405):
+                    raise
+                _logger.warning(f"sign server does not support batch request ({e.args[0]}), disabled")
+                self.batch_path = None
+        return list(await asyncio.gather(*[self.pool.sign(*i) for i in items]))
+
+    def _flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        items, self._batch = self._batch, []
+        if items:
+            asyncio.create_task(self._send_batch(items), name="sign_batch")
+
+    async def _send_batch(self, items: list[tuple[str, int, bytes, asyncio.Future[dict]]]):
+        self._inflight += 1
+        try:
+            results = await self.sign_batch([i[:3] for i in items])
+        except Exception as e:
+            for *_, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            for (*_, fut), result in zip(items, results):
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            self._inflight -= 1
+
+
+class LocalSigner(Signer):
+    """
+    使用进程内的函数签名, 不经过 http.
+    func(cmd, seq, buf) -> {"sign": ..., "token": ..., "extra": ...}, 可以是协程函数;
+    普通函数在指定 executor 时放到 executor 中执行
+    """
+
+    def __init__(self, func: Callable, executor: Optional[Executor] = None):
+        self.func = func
+        self.executor = executor
+
+    async def sign(self, cmd: str, seq: int, buf: bytes) -> dict:
+        if asyncio.iscoroutinefunction(self.func):
+            return await self.func(cmd, seq, buf)
+        if self.executor:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.func, cmd, seq, buf)
+        return self.func(cmd, seq, buf)
+
+
+class CachedSigner(Signer):
+    """
+    缓存 cmds 中命令的签名结果, 以 (cmd, body 的 sha1) 为键, 按 ttl 过期, 超过 max_size 时淘汰最久未使用的项.
+    只有签名不依赖 seq 时(seq_independent)同一请求体才能复用签名, 否则 seq 也是键的一部分, 只对重发同一个包有效.
+    prefetch 中的命令(心跳类)会在过期前用最近一次的请求体重新签名, 使调用方始终命中缓存;
+    一个刷新周期(ttl * refresh_ahead)内没有再被调用的请求不再续签, 因此 ttl 应大于调用间隔
+    """
+
+    def __init__(
+        self,
+        signer: Signer,
+        cmds: Iterable[str],
+        *,
+        ttl: float = 60.0,
+        max_size: int = 1024,
+        seq_independent: bool = False,
+        prefetch: Iterable[str] = (),
+        refresh_ahead: float = 0.8,
+    ):
+        self.signer = signer
+        self.cmds = frozenset(cmds)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.seq_independent = seq_independent
+        self.prefetch = frozenset(prefetch) if seq_independent else frozenset()
+        self.refresh_ahead = refresh_ahead
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.evictions = 0
+        # key -> (过期时间, 签名结果)
+        self._cache: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future[dict]] = {}
+        # prefetch 的 key -> (seq, buf, 自上次刷新后是否被使用过)
+        self._prefetch_src: dict[tuple, list] = {}
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "prefetches": self.prefetches,
+            "evictions": self.evictions,
+        }
+
+    def _key(self, cmd: str, seq: int, buf: bytes) -> tuple:
+        digest = hashlib.sha1(buf).digest()
+        return (cmd, digest) if self.seq_independent else (cmd, seq, digest)
+
+    def _get(self, key: tuple) -> Optional[dict]:
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return item[1]
+
+    def _put(self, key: tuple, value: dict):
+        self._cache[key] = (time.monotonic() + self.ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            old, _ = self._cache.popitem(last=False)
+            self._prefetch_src.pop(old, None)
+            self.evictions += 1
+
+    async def _fetch(self, key: tuple, cmd: str, seq: int, buf: bytes) -> dict:
+        # 同一个 key 同时只发出一次签名请求
+        fut = self._inflight.get(key)
+        if fut:
+            return await asyncio.shield(fut)
+        fut = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self.signer.sign(cmd, seq, buf)
+            self._put(key, value)
+            fut.set_result(value)
+            return value
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # 没有其他等待者时不报 never retrieved
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _schedule_refresh(self, key: tuple):
+        asyncio.get_running_loop().call_later(self.ttl * self.refresh_ahead, self._refresh, key)
+
+    def _refresh(self, key: tuple):
+        src = self._prefetch_src.get(key)
+        if not src or not src[2]:  # 上个周期内没有再用到, 不再续签
+            self._prefetch_src.pop(key, None)
+            return
+        src[2] = False
+        asyncio.create_task(self._prefetch(key, src[0], src[1]), name="sign_prefetch")
+
+    async def _prefetch(self, key: tuple, seq: int, buf: bytes):
+        try:
+            await self._fetch(key, key[0], seq, buf)
+        except Exception as e:
+            _logger.warning(f"prefetch sign for {key[0]} failed: {e!r}")
+            self._prefetch_src.pop(key, None)
+            return
+        self.prefetches += 1
+        self._schedule_refresh(key)
+
+    async def sign(self, cmd: str, seq: int, buf: bytes) -> dict:
+        if cmd not in self.cmds:
+            return await self.signer.sign(cmd, seq, buf)
+        key = self._key(cmd, seq, buf)
+        value = self._get(key)
+        if cmd in self.prefetch:
+            src = self._prefetch_src.get(key)
+            if src:
+                src[2] = True
+            else:
+                self._prefetch_src[key] = [seq, buf, False]
+                self._schedule_refresh(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        return await self._fetch(key, cmd, seq, buf)
+
+
+def sign_provider(upstream_url: Union[str, Callable], **options) -> Signer:
+    """upstream_url 为 http 地址时使用 HttpSigner, 为函数时使用 LocalSigner"""
+    if callable(upstream_url):
+        return LocalSigner(upstream_url, **options)
+    return HttpSigner(upstream_url, **options)
@@ -0,0 +1,103 @@
+"""
+A stand-in sign server for local benchmarks
+
+返回的签名是假的, 只能用于测试签名链路本身的开销:
+    python -m lagrange.utils.sign_server --port 8081 --delay 0.005
+单个签名 POST 任意路径, 批量签名 POST /batch(json 数组)
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+from typing import Optional
+
+from .log import log
+
+_logger = log.fork("sign_server")
+
+
+def fake_sign(cmd: str, seq: int, src: str) -> dict:
+    digest = hashlib.sha256(f"{cmd}:{seq}:{src}".encode()).hexdigest()
+    return {"sign": digest, "token": digest[:32], "extra": ""}
+
+
+class SignServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, delay: float = 0.0, batch_path: str = "/batch"):
+        self.host = host
+        self.port = port
+        self.delay = delay  # 模拟签名服务每个请求的耗时
+        self.batch_path = batch_path
+        self.requests = 0
+        self.signed = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: set[asyncio.StreamWriter] = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/sign"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *lines = head.decode().split("\r\n")
+                path = request_line.split(" ")[1]
+                header = {}
+                for line in lines:
+                    if line:
+                        k, v = line.split(":", 1)
+                        header[k.strip().lower()] = v.strip()
+                params = json.loads(await reader.readexactly(int(header.get("content-length", 0))))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                self.requests += 1
+                if path == self.batch_path:
+                    value = [fake_sign(p["cmd"], p["seq"], p["src"]) for p in params]
+                    self.signed += len(value)
+                else:
+                    value = fake_sign(params["cmd"], params["seq"], params["src"])
+                    self.signed += 1
+                body = json.dumps({"value": value}).encode()
+                close = header.get("connection", "").lower() == "close"
+                conn = "close" if close else "keep-alive"
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\nConnection: {conn}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        _logger.info(f"fake sign server listening on {self.url}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+            await asyncio.sleep(0)  # 让连接处理协程退出
+
+    async def serve_forever(self):
+        await self.start()
+        await self._server.serve_forever()  # type: ignore
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fake sign server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds per request")
+    args = parser.parse_args()
+    asyncio.run(SignServer(args.host, args.port, delay=args.delay).serve_forever())
@@ -0,0 +1,143 @@
+import asyncio
+import io
+import os
+import struct
+from hashlib import md5
+from types import SimpleNamespace
+
+from lagrange.client.highway.frame import write_frame
+from lagrange.client.highway.uploader import BlockUploadError, HighwayUploader, UploadProgress, UploadProgressStore
+from lagrange.pb.highway.head import HighwayTransReqHead, HighwayTransRespHead
+from lagrange.utils.log import log
+
+BLOCK = 4096
+
+
+class StubServer:
+    """只确认前 limit 个块, 之后的请求直接断开连接"""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.received: dict[int, tuple[bytes, bytes]] = {}  # offset -> (ext, data)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = next(
+                    int(line.split(b":", 1)[1])
+                    for line in head.split(b"\r\n")
+                    if line.lower().startswith(b"content-length")
+                )
+                body = await reader.readexactly(length)
+                if self.limit is not None and len(self.received) >= self.limit:
+                    return
+                hl, bl = struct.unpack("!II", body[1:9])
+                req = HighwayTransReqHead.decode(body[9 : 9 + hl])
+                self.received[req.seg_head.data_offset] = (req.req_ext_info, body[9 + hl : 9 + hl + bl])
+                rsp = write_frame(HighwayTransRespHead(err_code=0, allow_retry=0).encode(), b"")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(rsp) + bytes(rsp))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return [("127.0.0.1", self._server.sockets[0].getsockname()[1])]
+
+    async def __aexit__(self, *_):
+        self._server.close()
+
+
+def _session():
+    client = SimpleNamespace(
+        uin=10000, _sig=SimpleNamespace(tgt=b"t" * 16), app_info=SimpleNamespace(app_id=1, sub_app_id=2)
+    )
+    return SimpleNamespace(
+        _client=client, _session_key=b"", logger=log.fork("highway"), io_executor=None, inline_hash_size=65536
+    )
+
+
+def _uploader(payload: bytes, ext: bytes, store: UploadProgressStore) -> HighwayUploader:
+    return HighwayUploader(
+        _session(),
+        "PicUp.DataUp",
+        1004,
+        b"ticket",
+        ext,
+        [io.BytesIO(payload)],
+        file_md5=md5(payload).digest(),
+        block_size=BLOCK,
+        connections=2,
+        max_retries=1,
+        store=store,
+    )
+
+
+def _interrupted(payload: bytes, ext: bytes, store: UploadProgressStore) -> HighwayUploader:
+    async def run():
+        up = _uploader(payload, ext, store)
+        async with StubServer(limit=5) as addrs:
+            try:
+                await up.upload(addrs)
+            except BlockUploadError:
+                pass
+        return up
+
+    return asyncio.run(run())
+
+
+def _resume(payload: bytes, ext: bytes, store: UploadProgressStore):
+    async def run():
+        server = StubServer()
+        up = _uploader(payload, ext, store)
+        async with server as addrs:
+            await up.upload(addrs)
+        return up, server
+
+    return asyncio.run(run())
+
+
+def test_resume_with_same_ext_skips_acked_blocks():
+    payload = os.urandom(BLOCK * 16 + 100)
+    store = UploadProgressStore()
+    first = _interrupted(payload, b"ext-a", store)
+    acked, done = set(first.progress.acked), first.progress.done
+    assert 0 < len(acked) < 17
+
+    up, server = _resume(payload, b"ext-a", store)
+    assert set(server.received).isdisjoint(acked)
+    assert len(server.received) == 17 - len(acked)
+    assert up.stats.resumed == done
+    assert store.get(up.progress.key) is None
+
+
+def test_resume_with_new_ext_uploads_everything():
+    payload = os.urandom(BLOCK * 16 + 100)
+    store = UploadProgressStore()
+    _interrupted(payload, b"ext-a", store)
+
+    up, server = _resume(payload, b"ext-b", store)
+    assert len(server.received) == 17
+    assert up.stats.resumed == 0
+    assert all(ext == b"ext-b" for ext, _ in server.received.values())
+    assert b"".join(server.received[k][1] for k in sorted(server.received)) == payload
+
+
+def test_progress_store_keeps_large_entries(tmp_path):
+    progress = UploadProgress(
+        "k",
+        1 << 32,
+        BLOCK,
+        acked={i * BLOCK: BLOCK for i in range(20000)},
+        ext=os.urandom(70000),
+        ext_seed=md5(b"seed").digest(),
+        session_key=os.urandom(16),
+    )
+    UploadProgressStore(tmp_path).save(progress)
+
+    loaded = UploadProgressStore(tmp_path).get("k")
+    assert loaded == progress
+    assert loaded.done == 20000 * BLOCK
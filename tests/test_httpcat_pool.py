@@ -0,0 +1,32 @@
+import asyncio
+import socket
+import time
+
+from lagrange.utils.httpcat import HttpCatPool
+
+
+def test_loop_change_closes_idle_connections():
+    server = socket.create_server(("127.0.0.1", 0))
+    key = ("127.0.0.1", server.getsockname()[1], False)
+    pool = HttpCatPool(reap_interval=3600)
+
+    async def first():
+        conn = await asyncio.open_connection(*key[:2])
+        pool._get_host(key).idle.append((conn, time.monotonic()))
+        return conn, pool._reaper
+
+    conn, reaper = asyncio.run(first())
+    peer, _ = server.accept()
+    peer.settimeout(5)
+
+    async def second():
+        pool._get_host(key)
+        return pool._reaper
+
+    new_reaper = asyncio.run(second())
+    assert peer.recv(1) == b""  # 旧连接已被断开
+    assert conn[1].transport.is_closing()
+    assert reaper.done() and new_reaper is not reaper
+    peer.close()
+    server.close()
+
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from lagrange.client import network
+from lagrange.client.network import ClientNetwork
+
+
+def _packet(data: bytes):
+    return SimpleNamespace(seq=-1, cmd="push", ret_code=0, extra="", data=data)
+
+
+def _make_network(monkeypatch, gate: threading.Event, fail: bytes = b""):
+    def fake_decode(raw, key):
+        gate.wait(5)
+        if raw == fail:
+            raise ValueError("broken frame")
+        return 1, _packet(bytes(raw))
+
+    async def noop(*_):
+        pass
+
+    monkeypatch.setattr(network, "decode_sso_packet", fake_decode)
+    push: asyncio.Queue = asyncio.Queue()
+    net = ClientNetwork(
+        SimpleNamespace(d2_key=bytes(16)),
+        push,
+        noop,
+        noop,
+        decode_executor=ThreadPoolExecutor(1),
+        inline_decode_size=1,
+    )
+    return net, push
+
+
+def test_queued_frames_dropped_on_close(monkeypatch):
+    async def main():
+        gate = threading.Event()
+        net, push = _make_network(monkeypatch, gate)
+        await net.on_frame(b"old1")
+        await net.on_frame(b"old2")
+        assert net._decode_inflight == 2
+        await net.on_close()
+        gate.set()
+        await asyncio.sleep(0.05)
+        assert push.empty()
+        assert net._decode_inflight == 0
+
+        await net.on_frame(b"new")
+        await asyncio.sleep(0.05)
+        assert (await asyncio.wait_for(push.get(), 1)).data == b"new"
+        assert net._decode_inflight == 0
+        net._reset_decode_queue()
+
+    asyncio.run(main())
+
+
+def test_decode_error_not_carried_to_next_session(monkeypatch):
+    async def main():
+        gate = threading.Event()
+        gate.set()
+        net, push = _make_network(monkeypatch, gate, fail=b"bad")
+        await net.on_frame(b"bad")
+        await asyncio.sleep(0.05)
+        assert isinstance(net._decode_error, ValueError)
+        try:
+            raise ConnectionResetError
+        except ConnectionResetError:
+            assert await net.on_error() is False  # 解析错误不可恢复
+        assert net._decode_error is None
+        assert net._decode_inflight == 0
+
+        await net.on_frame(b"new")
+        await asyncio.sleep(0.05)
+        assert (await asyncio.wait_for(push.get(), 1)).data == b"new"
+        net._reset_decode_queue()
+
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+from typing import Optional
+
+from lagrange.utils.binary.protobuf import ProtoStruct, proto_field
+from lagrange.utils.binary.protobuf.models import _LazyField
+
+
+class Inner(ProtoStruct):
+    value: int = proto_field(1)
+
+
+class Eager(ProtoStruct):
+    inner: Optional[Inner] = proto_field(1, default=None)
+    name: str = proto_field(2, default="")
+
+
+class Lazy(ProtoStruct, lazy=True):
+    inner: Optional[Inner] = proto_field(1, default=None)
+    name: str = proto_field(2, default="")
+
+
+def test_lazy_roundtrip_untouched():
+    raw = Lazy(inner=Inner(value=1), name="a").encode()
+    assert Lazy.decode(raw).encode() == raw
+
+
+def test_lazy_assign_before_read_is_encoded():
+    raw = Lazy(inner=Inner(value=1), name="a").encode()
+    msg = Lazy.decode(raw)
+    msg.inner = Inner(value=2)
+    encoded = msg.encode()
+    assert encoded != raw
+    assert Lazy.decode(encoded).inner.value == 2
+    assert msg.inner.value == 2
+
+
+def test_lazy_read_then_assign_is_encoded():
+    msg = Lazy.decode(Lazy(inner=Inner(value=1)).encode())
+    assert msg.inner.value == 1
+    msg.inner = Inner(value=3)
+    assert Lazy.decode(msg.encode()).inner.value == 3
+
+
+def test_descriptor_only_on_lazy_classes():
+    Eager.decode(Eager(inner=Inner(value=1)).encode())
+    assert not isinstance(Eager.__dict__.get("inner"), _LazyField)
+    Lazy.decode(Lazy(inner=Inner(value=1)).encode())
+    assert isinstance(Lazy.__dict__.get("inner"), _LazyField)
+
+
+def test_nested_eager_struct_in_lazy_parent():
+    msg = Lazy.decode(Lazy(inner=Inner(value=5)).encode())
+    inner = msg.inner
+    assert inner.value == 5
+    assert "_proto_pending" not in inner.__dict__
@@ -0,0 +1,69 @@
+import asyncio
+import pickle
+import threading
+
+from lagrange.sharded import ShardedHost, _send
+
+
+class FakeConn:
+    def __init__(self):
+        self.sent = []
+
+    def send_bytes(self, data):
+        self.sent.append(pickle.loads(data))
+
+
+def _host():
+    host = ShardedHost(workers=3)
+    host._stopping = True  # 不重启退出的进程
+    for shard in host.shards:
+        shard.conn = FakeConn()
+        shard.process = object()
+    return host
+
+
+def _move(host, uin, src, dest):
+    host.shards[dest].accounts[uin] = "pw"
+    host._moving[uin] = (host.shards[src], host.shards[dest])
+
+
+def test_unrelated_exit_keeps_account_moving():
+    host = _host()
+    _move(host, 10, 0, 1)
+    dest_conn = host.shards[1].conn
+
+    host._on_exit(host.shards[2], host.shards[2].process)
+    assert dest_conn.sent == [] and 10 in host._moving
+
+    host._on_exit(host.shards[0], host.shards[0].process)
+    assert dest_conn.sent == [("add", 10, "pw")] and 10 not in host._moving
+
+
+def test_removed_only_accepted_from_source():
+    host = _host()
+    _move(host, 10, 0, 1)
+    host._on_message(host.shards[2], ("removed", 10))
+    assert host.shards[1].conn.sent == []
+
+    host._on_message(host.shards[0], ("removed", 10))
+    assert host.shards[1].conn.sent == [("add", 10, "pw")]
+
+
+def test_restarted_destination_waits_for_moving_accounts():
+    host = _host()
+    host.shards[1].accounts[20] = "own"
+    _move(host, 10, 0, 1)
+    assert host._startup_accounts(host.shards[1]) == [(20, "own")]
+
+
+def test_unpicklable_event_is_dropped():
+    conn = FakeConn()
+    lock = threading.Lock()
+    loop = asyncio.new_event_loop()
+    try:
+        assert not _send(conn, lock, "event", 1, loop.create_future())
+        assert not _send(conn, lock, "event", 1, lambda: None)
+    finally:
+        loop.close()
+    assert _send(conn, lock, "event", 1, "ok")
+    assert conn.sent == [("event", 1, "ok")]
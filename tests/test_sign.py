@@ -0,0 +1,19 @@
+import asyncio
+
+import pytest
+
+from lagrange.utils.sign import SIGN_PKG_LIST, LocalSigner, Signer
+
+
+def test_signer_requires_sign():
+    class Incomplete(Signer):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_local_signer_only_signs_listed_cmds():
+    signer = LocalSigner(lambda cmd, seq, buf: {"sign": buf.hex()})
+    assert asyncio.run(signer(SIGN_PKG_LIST[0], 1, b"\x01")) == {"sign": "01"}
+    assert asyncio.run(signer("not.signed", 1, b"\x01")) == {}
@@ -0,0 +1,30 @@
+import os
+
+from lagrange.utils.crypto.tea import qqtea_decrypt, qqtea_decrypt_many, qqtea_encrypt
+
+
+def test_roundtrip():
+    key = os.urandom(16)
+    for n in (0, 1, 7, 8, 100, 4096):
+        data = os.urandom(n)
+        assert qqtea_decrypt(qqtea_encrypt(data, key), key) == data
+
+
+def test_buffer_inputs():
+    key = os.urandom(16)
+    data = os.urandom(333)
+    enc = qqtea_encrypt(data, key)
+    assert qqtea_decrypt(memoryview(enc), key) == data
+    assert qqtea_decrypt(bytearray(enc), memoryview(key)) == data
+    padded = memoryview(b"\x00" * 3 + enc)[3:]  # 非对齐的切片, 与 Reader 返回的视图一致
+    assert qqtea_decrypt(padded, key) == data
+    assert qqtea_decrypt(qqtea_encrypt(memoryview(data), key), key) == data
+
+
+def test_decrypt_many():
+    key = os.urandom(16)
+    frames = [os.urandom(n) for n in (0, 5, 64, 1000)]
+    enc = [qqtea_encrypt(f, key) for f in frames]
+    enc[2] = memoryview(b"\x00" + enc[2])[1:]
+    assert qqtea_decrypt_many(enc, key) == frames
+    assert qqtea_decrypt_many([], key) == []
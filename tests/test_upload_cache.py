@@ -0,0 +1,76 @@
+import asyncio
+import json
+import sqlite3
+from dataclasses import replace
+from types import SimpleNamespace
+
+from lagrange.client.highway.cache import UploadCache
+from lagrange.client.highway.highway import HighWaySession
+from lagrange.client.message.elems import Audio, Image
+from lagrange.pb.highway.comm import IndexNode
+
+MD5 = bytes(range(16))
+
+
+def _image(url="https://gchat.qpic.cn/gchatpic_new/1/2-3-AB/0?term=2"):
+    return Image(
+        name="a.png", size=10, url=url, id=3, md5=MD5, qmsg=None,
+        width=1, height=2, is_emoji=False, display_name="[图片]",
+    )
+
+
+def _audio(url="https://grouptalk.c2c.qq.com/?ver=0&rkey=abcd&filetype=4"):
+    return Audio(name="a.amr", size=20, url=url, id=0, md5=MD5, qmsg=b"\x08\x01", time=3, file_key="fk")
+
+
+def test_disk_entries_are_json(tmp_path):
+    path = tmp_path / "cache.db"
+    cache = UploadCache(path)
+    cache.put(MD5, "image", 1, "", _image())
+    cache.close()
+
+    kind, raw = sqlite3.connect(path).execute("SELECT kind, elem FROM upload_cache_v2").fetchone()
+    assert kind == "image" and json.loads(raw)["md5"] == MD5.hex()
+
+    reloaded = UploadCache(path)
+    assert reloaded.get(MD5, "image", 1) == _image()
+    assert reloaded.disk_hits == 1
+
+
+def test_rkey_url_is_not_cached(tmp_path):
+    cache = UploadCache(tmp_path / "cache.db")
+    cache.put(MD5, "voice", 0, "u", _audio())
+    assert cache.get(MD5, "voice", 0, "u").url == ""
+
+    hit = UploadCache(tmp_path / "cache.db").get(MD5, "voice", 0, "u")
+    assert hit == _audio(url="")
+
+
+async def _get_pri_img_url(uid, node):
+    return f"https://multimedia.nt.qq.com.cn/download?fileid={node.file_uuid}&rkey=new"
+
+
+async def _get_audio_down_url(file_key, gid, uid):
+    return f"https://example/{file_key}?rkey=new"
+
+
+_SESSION = SimpleNamespace(get_pri_img_url=_get_pri_img_url, get_audio_down_url=_get_audio_down_url)
+
+
+def test_cached_audio_gets_fresh_url():
+    audio = asyncio.run(HighWaySession._refresh_url(_SESSION, _audio(url=""), b"", 0, "u"))
+    assert audio.url == "https://example/fk?rkey=new"
+
+
+def test_private_image_hit_gets_fresh_url(tmp_path):
+    node = IndexNode(file_uuid="uuid").encode()
+    private = replace(
+        _image(url="https://multimedia.nt.qq.com.cn/download?fileid=uuid&rkey=old"), id=0, qmsg=b"\x08\x01"
+    )
+    UploadCache(tmp_path / "cache.db").put(MD5, "image", 0, "u", private, node)
+
+    hit, cached_node = UploadCache(tmp_path / "cache.db").lookup(MD5, "image", 0, "u")
+    assert hit.url == "" and cached_node == node
+    image = asyncio.run(HighWaySession._refresh_url(_SESSION, hit, cached_node, 0, "u"))
+    assert image.url == "https://multimedia.nt.qq.com.cn/download?fileid=uuid&rkey=new"
+    assert image.qmsg == b"\x08\x01"